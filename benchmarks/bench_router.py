@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+路由匹配微基准
+对比前缀树路由与原先 handle_request 中 if/elif 链的匹配耗时
+用法：python benchmarks/bench_router.py
+"""
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import worker
+
+PATHS = [
+    '/api/login',
+    '/api/grades',
+    '/api/grades/3f2b6c1e-8a0d-4c55-9a51-2f0e4b1d7c90',
+    '/api/import/grades',
+    '/api/analysis/class/class_1',
+    '/api/analysis/class/summary/class_1',
+    '/api/analysis/student/longitudinal/student_1',
+    '/api/analysis/student/advice/student_1',
+    '/api/analysis/comparison/class_1',
+    '/api/analysis/correlation/class_1',
+    '/app.js',
+    '/missing/path',
+]
+
+def legacy_route(path):
+    """原先的 if/elif 路由链（仅返回匹配到的处理函数名）"""
+    if path.endswith('/api/login'):
+        return 'on_request_login'
+    elif path.endswith('/api/logout'):
+        return 'on_request_logout'
+    elif path.startswith('/api/grades'):
+        return 'on_request_grades'
+    elif path.startswith('/api/template/grades.xlsx'):
+        return 'on_request_template'
+    elif path.startswith('/api/import/grades'):
+        return 'on_request_import_grades'
+    elif path.startswith('/api/analysis/class/'):
+        if 'summary' in path:
+            return 'on_request_analysis_class_summary'
+        else:
+            return 'on_request_analysis_class'
+    elif path.startswith('/api/analysis/student/longitudinal/'):
+        return 'on_request_analysis_student_longitudinal'
+    elif path.startswith('/api/analysis/student/advice/'):
+        return 'on_request_analysis_student_advice'
+    elif path.startswith('/api/analysis/comparison/'):
+        return 'on_request_analysis_comparison'
+    elif path.startswith('/api/analysis/correlation/'):
+        return 'on_request_analysis_correlation'
+    elif path == '/' or path == '/index.html':
+        return 'index.html'
+    elif path == '/styles.css':
+        return 'styles.css'
+    elif path == '/app.js':
+        return 'app.js'
+    return None
+
+def run_legacy():
+    for path in PATHS:
+        # 原实现还需要在处理函数中再次拆分URL取参数
+        legacy_route(path)
+        path.split('/')
+
+def run_router():
+    for path in PATHS:
+        worker.ROUTER.match(path)
+
+def main():
+    number = 20000
+    for name, func in [('if/elif chain', run_legacy), ('segment trie', run_router)]:
+        best = min(timeit.repeat(func, number=number, repeat=5))
+        print(f"{name:>14}: {best / (number * len(PATHS)) * 1e6:.3f} us/match")
+
+if __name__ == '__main__':
+    main()
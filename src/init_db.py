@@ -1,14 +1,59 @@
 #!/usr/bin/env python3
 """
 数据库初始化脚本
-用于创建D1数据库表结构
+用于创建D1数据库表结构、执行版本化迁移并检查查询计划
 """
 
+import argparse
+import json
 import sqlite3
 import os
+import sys
 
-# 创建表的SQL语句
-CREATE_TABLES_SQL = """
+import worker
+
+# 从成绩表重建汇总表的SQL语句
+REBUILD_STATS_SQL = """
+DELETE FROM grade_stats;
+INSERT INTO grade_stats (class_id, exam_name, subject, score_count, score_sum, score_min, score_max,
+                         score_median, score_histogram, dirty)
+SELECT class_id, exam_name, subject, SUM(score_count), SUM(score * score_count), MIN(score), MAX(score),
+       AVG(CASE WHEN (total + 1) / 2 BETWEEN first_pos AND last_pos
+                  OR (total + 2) / 2 BETWEEN first_pos AND last_pos THEN score END),
+       json_group_object(CAST(score AS TEXT), score_count), 0
+FROM (
+    SELECT class_id, exam_name, subject, score, score_count,
+           SUM(score_count) OVER w - score_count + 1 AS first_pos,
+           SUM(score_count) OVER w AS last_pos,
+           SUM(score_count) OVER (PARTITION BY class_id, exam_name, subject) AS total
+    FROM (
+        SELECT s.class_id, g.exam_name, g.subject, g.score, COUNT(*) AS score_count
+        FROM grades g
+        JOIN students s ON g.student_id = s.id
+        GROUP BY s.class_id, g.exam_name, g.subject, g.score
+    )
+    WINDOW w AS (PARTITION BY class_id, exam_name, subject ORDER BY score)
+)
+GROUP BY class_id, exam_name, subject;
+
+DELETE FROM grade_level_stats;
+INSERT INTO grade_level_stats (grade_level, exam_name, subject, score_count, score_sum, score_histogram, dirty)
+SELECT grade_level, exam_name, subject, SUM(score_count), SUM(CAST(score_key AS REAL) * score_count),
+       json_group_object(score_key, score_count), 0
+FROM (
+    SELECT c.grade_level, gs.exam_name, gs.subject, bin.key AS score_key, SUM(bin.value) AS score_count
+    FROM grade_stats gs
+    JOIN classes c ON gs.class_id = c.id
+    JOIN json_each(gs.score_histogram) AS bin
+    GROUP BY c.grade_level, gs.exam_name, gs.subject, bin.key
+)
+GROUP BY grade_level, exam_name, subject;
+"""
+
+# 版本化的数据库迁移：(版本号, 说明, SQL)
+# 已发布的迁移不可修改，结构变更只能追加新的迁移；SQL需可重复执行
+MIGRATIONS = [
+    (1, '创建基础表', """
 -- 创建用户表
 CREATE TABLE IF NOT EXISTS users (
     id TEXT PRIMARY KEY,
@@ -44,23 +89,332 @@ CREATE TABLE IF NOT EXISTS grades (
     teacher_id TEXT NOT NULL
 );
 
--- 创建索引
 CREATE INDEX IF NOT EXISTS idx_students_class_id ON students(class_id);
 CREATE INDEX IF NOT EXISTS idx_grades_student_id ON grades(student_id);
+"""),
+    (2, '创建成绩汇总表', """
+-- 创建班级成绩汇总表（按班级、考试、科目预聚合成绩）
+CREATE TABLE IF NOT EXISTS grade_stats (
+    class_id TEXT NOT NULL,
+    exam_name TEXT NOT NULL,
+    subject TEXT NOT NULL,
+    score_count INTEGER NOT NULL DEFAULT 0,
+    score_sum REAL NOT NULL DEFAULT 0,
+    score_min REAL,
+    score_max REAL,
+    score_median REAL,
+    score_histogram TEXT,
+    dirty INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (class_id, exam_name, subject)
+);
+
+-- 创建年级汇总表（按年级、考试、科目预聚合成绩）
+CREATE TABLE IF NOT EXISTS grade_level_stats (
+    grade_level INTEGER NOT NULL,
+    exam_name TEXT NOT NULL,
+    subject TEXT NOT NULL,
+    score_count INTEGER NOT NULL DEFAULT 0,
+    score_sum REAL NOT NULL DEFAULT 0,
+    score_histogram TEXT,
+    dirty INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (grade_level, exam_name, subject)
+);
+"""),
+    (3, '添加成绩查询复合索引', """
+-- 学生各科目按日期查询（纵向趋势、各科最新成绩）
+CREATE INDEX IF NOT EXISTS idx_grades_student_subject_date ON grades(student_id, subject, exam_date);
+
+-- 班级某次考试的成绩（按考试名称定位后联表学生，分数直接从索引读取）
+CREATE INDEX IF NOT EXISTS idx_grades_exam_student_score ON grades(exam_name, student_id, score);
+
+-- 年级汇总按班级查找
+CREATE INDEX IF NOT EXISTS idx_classes_grade_level ON classes(grade_level);
+
+-- student_id 单列索引已被复合索引的前缀覆盖
+DROP INDEX IF EXISTS idx_grades_student_id;
+"""),
+    (4, '创建班级数据版本表', """
+-- 成绩变更时递增，用于分析结果缓存失效
+CREATE TABLE IF NOT EXISTS class_versions (
+    class_id TEXT PRIMARY KEY,
+    version INTEGER NOT NULL DEFAULT 0
+);
+"""),
+    (5, '创建AI总结缓存表', """
+-- 以提示词哈希为键保存AI生成的总结，过期后重新生成
+CREATE TABLE IF NOT EXISTS ai_summaries (
+    prompt_hash TEXT PRIMARY KEY,
+    scope TEXT NOT NULL,
+    summary TEXT NOT NULL,
+    created_at INTEGER NOT NULL,
+    expires_at INTEGER NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_ai_summaries_scope ON ai_summaries(scope);
+CREATE INDEX IF NOT EXISTS idx_ai_summaries_expires_at ON ai_summaries(expires_at);
+"""),
+    (6, '创建AI报告任务表', """
+-- 状态：pending -> running -> done / failed
+CREATE TABLE IF NOT EXISTS ai_jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    target_id TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    result TEXT,
+    error TEXT,
+    created_by TEXT NOT NULL,
+    created_at INTEGER NOT NULL,
+    updated_at INTEGER NOT NULL
+);
+"""),
+    (7, '添加成绩分页查询索引', """
+-- 按 (exam_date, id) 键集分页及日期范围过滤
+CREATE INDEX IF NOT EXISTS idx_grades_date_id ON grades(exam_date, id);
+
+-- 按科目过滤后按 (exam_date, id) 分页
+CREATE INDEX IF NOT EXISTS idx_grades_subject_date_id ON grades(subject, exam_date, id);
+"""),
+    (8, '成绩按 (学生, 科目, 考试) 去重并添加唯一索引', """
+-- 同一学生同一科目同一次考试只保留最后录入的一条成绩
+DELETE FROM grades
+WHERE rowid NOT IN (
+    SELECT MAX(rowid) FROM grades GROUP BY student_id, subject, exam_name
+);
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_grades_student_subject_exam ON grades(student_id, subject, exam_name);
+
+-- 去重后重建汇总表，并使分析结果缓存失效
+-- （发布时 REBUILD_STATS_SQL 的副本：迁移内容不可随之后的汇总逻辑变化）
+DELETE FROM grade_stats;
+INSERT INTO grade_stats (class_id, exam_name, subject, score_count, score_sum, score_min, score_max,
+                         score_median, score_histogram, dirty)
+SELECT class_id, exam_name, subject, SUM(score_count), SUM(score * score_count), MIN(score), MAX(score),
+       AVG(CASE WHEN (total + 1) / 2 BETWEEN first_pos AND last_pos
+                  OR (total + 2) / 2 BETWEEN first_pos AND last_pos THEN score END),
+       json_group_object(CAST(score AS TEXT), score_count), 0
+FROM (
+    SELECT class_id, exam_name, subject, score, score_count,
+           SUM(score_count) OVER w - score_count + 1 AS first_pos,
+           SUM(score_count) OVER w AS last_pos,
+           SUM(score_count) OVER (PARTITION BY class_id, exam_name, subject) AS total
+    FROM (
+        SELECT s.class_id, g.exam_name, g.subject, g.score, COUNT(*) AS score_count
+        FROM grades g
+        JOIN students s ON g.student_id = s.id
+        GROUP BY s.class_id, g.exam_name, g.subject, g.score
+    )
+    WINDOW w AS (PARTITION BY class_id, exam_name, subject ORDER BY score)
+)
+GROUP BY class_id, exam_name, subject;
+
+DELETE FROM grade_level_stats;
+INSERT INTO grade_level_stats (grade_level, exam_name, subject, score_count, score_sum, score_histogram, dirty)
+SELECT grade_level, exam_name, subject, SUM(score_count), SUM(CAST(score_key AS REAL) * score_count),
+       json_group_object(score_key, score_count), 0
+FROM (
+    SELECT c.grade_level, gs.exam_name, gs.subject, bin.key AS score_key, SUM(bin.value) AS score_count
+    FROM grade_stats gs
+    JOIN classes c ON gs.class_id = c.id
+    JOIN json_each(gs.score_histogram) AS bin
+    GROUP BY c.grade_level, gs.exam_name, gs.subject, bin.key
+)
+GROUP BY grade_level, exam_name, subject;
+
+UPDATE class_versions SET version = version + 1;
+"""),
+    (9, '添加按考试过滤的成绩分页查询索引', """
+-- 按考试过滤后按 (exam_date, id) 分页，避免取出整次考试的成绩再排序
+CREATE INDEX IF NOT EXISTS idx_grades_exam_date_id ON grades(exam_name, exam_date, id);
+"""),
+]
+
+SCHEMA_MIGRATIONS_SQL = """
+CREATE TABLE IF NOT EXISTS schema_migrations (
+    version INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    applied_at TEXT NOT NULL DEFAULT (datetime('now'))
+);
 """
 
+def grade_list_check(name, filters, cursor, index_name, fields=('id', 'exam_date', 'score'),
+                     limit=worker.GRADE_LIST_DEFAULT_LIMIT, caller='list_grades'):
+    """按 worker.build_grade_list_query 生成的成绩分页查询构造执行计划检查项"""
+    query, params = worker.build_grade_list_query(filters, list(fields), cursor)
+    return (f'{caller} ({name})', query, tuple(params) + (limit + 1,), index_name)
+
+def grade_export_check(name, filters, index_name):
+    """导出逐页读取成绩（iter_grade_pages）第二页起的执行计划检查项"""
+    return grade_list_check(
+        name, filters, ('2023-06-01', 'grade_1'), index_name,
+        fields=worker.EXPORT_FIELDS + ['id'], limit=worker.EXPORT_PAGE_SIZE, caller='iter_grade_pages'
+    )
+
+# 热点查询的执行计划检查：(说明, SQL, 参数, 期望使用的索引)
+# SQL直接取自 worker.py 的常量和查询构造函数；索引为元组时使用其中任一个即可，为列表时必须全部使用
+QUERY_PLAN_CHECKS = [
+    (
+        'get_grades_by_student',
+        worker.GRADES_BY_STUDENT_SQL,
+        ('student_1',),
+        ('idx_grades_student_subject_date', 'idx_grades_student_subject_exam'),
+    ),
+    (
+        'get_latest_grades_by_class',
+        worker.LATEST_GRADES_BY_CLASS_SQL,
+        ('class_1',),
+        ('idx_grades_student_subject_date', 'idx_grades_student_subject_exam'),
+    ),
+    (
+        'get_latest_grades_by_grade_level (classes)',
+        worker.GRADE_LEVEL_CLASSES_SQL,
+        (3,),
+        ['idx_classes_grade_level', 'idx_students_class_id'],
+    ),
+    (
+        'get_latest_grades_by_grade_level (grades)',
+        worker.LATEST_GRADES_BY_GRADE_LEVEL_SQL,
+        (3,),
+        # 两个索引都以 student_id 开头，按学生定位成绩时规划器可能选择其中任一个
+        ('idx_grades_student_subject_date', 'idx_grades_student_subject_exam'),
+    ),
+    (
+        'get_grades_by_class_and_exam',
+        worker.GRADES_BY_CLASS_AND_EXAM_SQL,
+        ('class_1', '期中考试'),
+        # 两个索引都以 exam_name 开头，按考试定位成绩时规划器可能选择其中任一个
+        ('idx_grades_exam_student_score', 'idx_grades_exam_date_id'),
+    ),
+    (
+        'get_grade_level_comparison (classes)',
+        worker.GRADE_LEVEL_CLASS_AVERAGES_SQL,
+        (3, '期中考试'),
+        ['idx_classes_grade_level', 'sqlite_autoindex_grade_stats_1'],
+    ),
+    (
+        'get_grade_level_comparison (subjects)',
+        worker.GRADE_LEVEL_SUBJECT_STATS_SQL,
+        (3, '期中考试'),
+        'sqlite_autoindex_grade_level_stats_1',
+    ),
+    (
+        'prefetch_grade_write_targets',
+        worker.build_grade_key_lookup(2),
+        ('student_1', '数学', '期中考试', 'student_1', '语文', '期中考试'),
+        'idx_grades_student_subject_exam',
+    ),
+]
+
+# 成绩分页查询（列表与导出共用）除使用索引外，还必须按索引顺序取行而不使用临时B树排序，
+# 否则每一页都要先取出全部匹配行再排序，导出逐页翻完时总开销随数据量平方增长
+GRADE_LIST_PLAN_CHECKS = [
+    grade_list_check(
+        'date range', {'date_from': '2023-01-01', 'date_to': '2023-12-31'}, ('2023-06-01', 'grade_1'),
+        'idx_grades_date_id'
+    ),
+    grade_list_check('subject', {'subject': '数学'}, None, 'idx_grades_subject_date_id'),
+    grade_list_check('exam_name', {'exam_name': '期中考试'}, None, 'idx_grades_exam_date_id'),
+    grade_list_check(
+        'exam_name + class_id', {'exam_name': '期中考试', 'class_id': 'class_1'}, ('2023-06-01', 'grade_1'),
+        'idx_grades_exam_date_id'
+    ),
+    grade_list_check('class_id', {'class_id': 'class_1'}, None, 'idx_grades_date_id'),
+    grade_list_check('class_id page 2', {'class_id': 'class_1'}, ('2023-06-01', 'grade_1'), 'idx_grades_date_id'),
+    grade_list_check('grade_level', {'grade_level': 3}, None, 'idx_grades_date_id'),
+    grade_list_check(
+        'grade_level + exam_name', {'grade_level': 3, 'exam_name': '期中考试'}, None, 'idx_grades_exam_date_id'
+    ),
+    # 导出只允许按班级、考试或年级限定范围
+    grade_export_check('class_id', {'class_id': 'class_1'}, 'idx_grades_date_id'),
+    grade_export_check('exam_name', {'exam_name': '期中考试'}, 'idx_grades_exam_date_id'),
+    grade_export_check('grade_level', {'grade_level': 3}, 'idx_grades_date_id'),
+]
+
+QUERY_PLAN_CHECKS += GRADE_LIST_PLAN_CHECKS
+
+def get_applied_versions(conn):
+    """返回已执行的迁移版本号集合"""
+    conn.executescript(SCHEMA_MIGRATIONS_SQL)
+    return {row[0] for row in conn.execute("SELECT version FROM schema_migrations")}
+
+def apply_migrations(conn):
+    """按版本顺序执行尚未执行的迁移，每个迁移在独立事务中完成"""
+    applied = get_applied_versions(conn)
+    executed = []
+    for version, name, sql in MIGRATIONS:
+        if version in applied:
+            continue
+        conn.executescript(
+            "BEGIN;\n" + sql
+            + f"\nINSERT INTO schema_migrations (version, name) VALUES ({version}, '{name}');\nCOMMIT;"
+        )
+        executed.append(version)
+    return executed
+
+# 查询线上已执行迁移的SQL，配合 wrangler d1 execute --json --command 使用
+APPLIED_VERSIONS_SQL = "SELECT version FROM schema_migrations"
+
+def parse_applied_versions(output):
+    """从 wrangler d1 execute --json 的输出中读取已执行的迁移版本号集合"""
+    data = json.loads(output)
+    if isinstance(data, dict):
+        data = [data]
+    return {row['version'] for result in data for row in result.get('results', [])}
+
+def render_migrations_sql(applied=()):
+    """生成可直接交给 wrangler d1 execute --file 执行的迁移SQL，只包含 applied 之外尚未执行的迁移"""
+    parts = [SCHEMA_MIGRATIONS_SQL.strip()]
+    for version, name, sql in MIGRATIONS:
+        if version in applied:
+            continue
+        parts.append(f"-- 迁移 {version}: {name}\n{sql.strip()}")
+        parts.append(f"INSERT OR IGNORE INTO schema_migrations (version, name) VALUES ({version}, '{name}');")
+    return "\n\n".join(parts) + "\n"
+
+def query_plan_uses_index(plan, index_name):
+    """判断执行计划是否使用了期望的索引（元组为任一个，列表为全部）"""
+    if isinstance(index_name, list):
+        return all(any(index in detail for detail in plan) for index in index_name)
+    index_names = index_name if isinstance(index_name, tuple) else (index_name,)
+    return any(index in detail for detail in plan for index in index_names)
+
+def query_plan_uses_temp_sort(plan):
+    """判断执行计划是否需要用临时B树排序"""
+    return any(detail.startswith('USE TEMP B-TREE FOR ORDER BY') for detail in plan)
+
+def explain_query_plan(conn, sql, params):
+    """返回查询计划各步骤的说明"""
+    return [row[-1] for row in conn.execute("EXPLAIN QUERY PLAN " + sql, params)]
+
+def check_query_plans(conn):
+    """检查热点查询的执行计划是否使用了预期的索引、成绩分页查询是否免于临时排序，返回 (说明, 问题, 执行计划) 列表"""
+    failures = []
+    for name, sql, params, index_name in QUERY_PLAN_CHECKS:
+        plan = explain_query_plan(conn, sql, params)
+        if not query_plan_uses_index(plan, index_name):
+            failures.append((name, f'未使用索引 {index_name}', plan))
+    for name, sql, params, index_name in GRADE_LIST_PLAN_CHECKS:
+        plan = explain_query_plan(conn, sql, params)
+        if query_plan_uses_temp_sort(plan):
+            failures.append((name, '使用了临时B树排序', plan))
+    return failures
+
 def init_database():
     """初始化数据库"""
     # 连接到D1数据库（在本地使用SQLite进行测试）
     conn = sqlite3.connect('class_py_test.db')
     cursor = conn.cursor()
     
-    # 执行创建表的SQL
-    cursor.executescript(CREATE_TABLES_SQL)
+    # 执行尚未执行的迁移
+    executed = apply_migrations(conn)
+    if executed:
+        print(f"已执行迁移：{', '.join(str(version) for version in executed)}")
     
     # 插入测试数据
     insert_test_data(cursor)
     
+    # 根据成绩数据重建汇总表
+    cursor.executescript(REBUILD_STATS_SQL)
+    
     # 提交更改并关闭连接
     conn.commit()
     conn.close()
@@ -127,5 +481,36 @@ def insert_test_data(cursor):
         VALUES (?, ?, ?, ?, ?, ?, ?)
     """, ("grade_6", "student_2", "英语", 85.0, "2023-06-15", "期中考试", "teacher"))
 
+def main():
+    """命令行入口"""
+    parser = argparse.ArgumentParser(description='数据库初始化与迁移工具')
+    parser.add_argument('--print-sql', action='store_true', help='输出尚未执行的迁移SQL（用于 wrangler d1 execute）')
+    parser.add_argument(
+        '--applied', metavar='FILE',
+        help=f'已执行迁移的查询结果（wrangler d1 execute --json --command "{APPLIED_VERSIONS_SQL}" 的输出，'
+             '- 表示标准输入）；省略时视为全新数据库，输出全部迁移'
+    )
+    parser.add_argument('--check-plans', action='store_true', help='检查热点查询是否命中索引')
+    args = parser.parse_args()
+    
+    if args.print_sql:
+        applied = set()
+        if args.applied:
+            with (sys.stdin if args.applied == '-' else open(args.applied, encoding='utf-8')) as f:
+                applied = parse_applied_versions(f.read())
+        print(render_migrations_sql(applied))
+    elif args.check_plans:
+        conn = sqlite3.connect(':memory:')
+        apply_migrations(conn)
+        insert_test_data(conn.cursor())
+        failures = check_query_plans(conn)
+        for name, problem, plan in failures:
+            print(f"{name}: {problem}，执行计划：{plan}")
+        if failures:
+            sys.exit(1)
+        print("执行计划检查通过！")
+    else:
+        init_database()
+
 if __name__ == "__main__":
-    init_database()
\ No newline at end of file
+    main()
\ No newline at end of file
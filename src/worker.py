@@ -4,8 +4,20 @@ import jwt
 import time
 import os
 import uuid
-from urllib.parse import parse_qs
-import statistics
+import re
+import csv
+import codecs
+import itertools
+import io
+import zipfile
+import tempfile
+import datetime
+import math
+from collections import OrderedDict
+import xml.etree.ElementTree as ET
+from xml.sax.saxutils import escape as xml_escape
+import base64
+from urllib.parse import parse_qs, unquote, urlsplit
 
 # JWT密钥配置
 JWT_SECRET = os.environ.get('JWT_SECRET', 'YOUR_HIGHLY_SECRET_KEY')
@@ -50,6 +62,81 @@ def verify_token(token):
     except jwt.InvalidTokenError:
         return None  # 无效token
 
+# 分析结果缓存：键为 (接口, 班级, 查询参数, 角色范围, 数据版本号)，
+# 成绩写入会递增班级版本号，旧版本的缓存不再命中并随LRU淘汰
+ANALYSIS_CACHE_SIZE = 256
+analysis_cache = OrderedDict()
+analysis_cache_stats = {'hits': 0, 'misses': 0}
+
+def cache_analysis_response(scope):
+    """装饰器：按班级（scope='class'）或年级（scope='grade_level'）数据版本缓存分析结果"""
+    def decorator(handler):
+        def wrapper(env, request, params):
+            user = env['user']
+            class_id = params['class_id']
+            if scope == 'grade_level':
+                version = get_grade_level_version(env, class_id)
+            else:
+                version = get_class_version(env, class_id)
+            
+            key = (
+                handler.__name__,
+                class_id,
+                tuple(sorted(parse_query_params(request.url).items())),
+                (user['role'], user.get('class_id')),
+                version
+            )
+            cached = analysis_cache.get(key)
+            if cached is not None:
+                analysis_cache.move_to_end(key)
+                analysis_cache_stats['hits'] += 1
+                return {
+                    'status': cached['status'],
+                    'headers': dict(cached['headers'], **{'X-Cache': 'HIT'}),
+                    'body': cached['body']
+                }
+            
+            analysis_cache_stats['misses'] += 1
+            response = handler(env, request, params)
+            if response['status'] == 200:
+                analysis_cache[key] = response
+                if len(analysis_cache) > ANALYSIS_CACHE_SIZE:
+                    analysis_cache.popitem(last=False)
+            return {
+                'status': response['status'],
+                'headers': dict(response['headers'], **{'X-Cache': 'MISS'}),
+                'body': response['body']
+            }
+        
+        wrapper.__name__ = handler.__name__
+        return wrapper
+    return decorator
+
+# 已验证token的LRU缓存：键为token的SHA-256摘要，缓存到token的exp为止
+TOKEN_CACHE_SIZE = 1024
+token_cache = OrderedDict()
+token_cache_stats = {'hits': 0, 'misses': 0}
+
+def verify_token_cached(token):
+    """带缓存的token验证，对过期和无效token的处理与 verify_token 一致"""
+    key = hashlib.sha256(token.encode()).hexdigest()
+    payload = token_cache.get(key)
+    if payload is not None:
+        exp = payload.get('exp')
+        if exp is None or time.time() < exp:
+            token_cache.move_to_end(key)
+            token_cache_stats['hits'] += 1
+            return dict(payload)
+        del token_cache[key]  # 已过期，交由 verify_token 判定
+    
+    token_cache_stats['misses'] += 1
+    payload = verify_token(token)
+    if payload is not None:
+        token_cache[key] = dict(payload)
+        if len(token_cache) > TOKEN_CACHE_SIZE:
+            token_cache.popitem(last=False)
+    return payload
+
 def authenticate_user(username, password):
     """验证用户身份"""
     if username in users_db:
@@ -62,7 +149,7 @@ def authenticate_user(username, password):
             }
     return None
 
-def on_request_login(env, request):
+def on_request_login(env, request, params):
     """处理登录请求"""
     # 解析请求体
     body = request.body.read().decode('utf-8')
@@ -85,7 +172,7 @@ def on_request_login(env, request):
             'body': json.dumps({'error': 'Invalid username or password'})
         }
 
-def on_request_logout(env, request):
+def on_request_logout(env, request, params):
     """处理登出请求"""
     return {
         'status': 200,
@@ -95,7 +182,7 @@ def on_request_logout(env, request):
 
 def require_auth(handler):
     """装饰器：验证用户身份"""
-    def wrapper(env, request):
+    def wrapper(env, request, *args):
         # 获取Authorization头
         auth_header = request.headers.get('Authorization')
         if not auth_header or not auth_header.startswith('Bearer '):
@@ -106,7 +193,7 @@ def require_auth(handler):
             }
         
         token = auth_header.split(' ')[1]
-        payload = verify_token(token)
+        payload = verify_token_cached(token)
         if not payload:
             return {
                 'status': 401,
@@ -116,49 +203,369 @@ def require_auth(handler):
         
         # 将用户信息添加到环境变量中
         env['user'] = payload
-        return handler(env, request)
+        return handler(env, request, *args)
     
     return wrapper
 
-# D1数据库操作函数
-def create_class(env, class_id, grade_level, class_name):
-    """创建班级"""
+# 分数直方图：分数有界（0-100，最小单位半分），按分数值计数即可精确求分位数，
+# 且可增量增删、跨班级合并，并以JSON形式存入汇总表
+SCORE_PERCENTILES = {'p10': 0.1, 'p25': 0.25, 'p75': 0.75, 'p90': 0.9}
+
+class ScoreHistogram:
+    """可合并的分数直方图"""
+    
+    def __init__(self, counts=None):
+        self.counts = {}
+        for score, count in (counts or {}).items():
+            self.add(float(score), int(count))
+    
+    @classmethod
+    def from_scores(cls, scores):
+        """由分数列表构建直方图"""
+        histogram = cls()
+        for score in scores:
+            histogram.add(score)
+        return histogram
+    
+    @classmethod
+    def from_json(cls, text):
+        """由汇总表中存储的JSON还原直方图"""
+        return cls(json.loads(text) if text else None)
+    
+    def to_json(self):
+        """序列化为JSON（键为分数）"""
+        return json.dumps({str(score): count for score, count in sorted(self.counts.items())})
+    
+    def add(self, score, count=1):
+        """增加分数"""
+        score = float(score)
+        self.counts[score] = self.counts.get(score, 0) + count
+        if self.counts[score] <= 0:
+            del self.counts[score]
+    
+    def remove(self, score, count=1):
+        """移除分数"""
+        score = float(score)
+        if self.counts.get(score, 0) < count:
+            raise ValueError(f'Score {score} not in histogram')
+        self.add(score, -count)
+    
+    def merge(self, other):
+        """合并另一个直方图（原地修改并返回自身）"""
+        for score, count in other.counts.items():
+            self.add(score, count)
+        return self
+    
+    @property
+    def total(self):
+        return sum(self.counts.values())
+    
+    def value_at(self, position):
+        """返回从小到大第 position 个分数（从0开始）"""
+        seen = 0
+        for score in sorted(self.counts):
+            seen += self.counts[score]
+            if position < seen:
+                return score
+        raise IndexError(position)
+    
+    def quantile(self, q):
+        """线性插值分位数，q=0.5 时与 statistics.median 一致"""
+        total = self.total
+        if not total:
+            return None
+        position = q * (total - 1)
+        lower = int(position)
+        lower_value = self.value_at(lower)
+        if position == lower:
+            return lower_value
+        upper_value = self.value_at(lower + 1)
+        return lower_value + (upper_value - lower_value) * (position - lower)
+    
+    def median(self):
+        return self.quantile(0.5)
+    
+    def percentiles(self):
+        """返回 P10/P25/P75/P90"""
+        return {name: self.quantile(q) for name, q in SCORE_PERCENTILES.items()}
+    
+    def summary(self):
+        """返回平均分、中位数、最值、人数及分位数"""
+        total = self.total
+        if not total:
+            return None
+        return {
+            'average': round(sum(score * count for score, count in self.counts.items()) / total, 2),
+            'median': self.median(),
+            'min': min(self.counts),
+            'max': max(self.counts),
+            'count': total,
+            'percentiles': self.percentiles()
+        }
+
+# D1单条语句的绑定参数上限
+D1_MAX_BOUND_PARAMS = 100
+
+def chunked(items, size):
+    """按固定大小切分列表"""
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+# 成绩汇总表维护：写入成绩时先标记受影响的汇总行，再在同一事务中只重算被标记的行。
+# grade_stats 按 (班级, 考试, 科目) 从成绩表重算，grade_level_stats 再由 grade_stats 汇总到年级
+GRADE_STATS_MARK_SQL = """
+    INSERT INTO grade_stats (class_id, exam_name, subject, score_count, score_sum, dirty)
+    SELECT DISTINCT s.class_id, g.exam_name, g.subject, 0, 0, 1
+    FROM grades g
+    JOIN students s ON g.student_id = s.id
+    WHERE g.id IN ({placeholders})
+    ON CONFLICT(class_id, exam_name, subject) DO UPDATE SET dirty = 1
+"""
+
+GRADE_LEVEL_STATS_MARK_SQL = """
+    INSERT INTO grade_level_stats (grade_level, exam_name, subject, score_count, score_sum, dirty)
+    SELECT DISTINCT c.grade_level, g.exam_name, g.subject, 0, 0, 1
+    FROM grades g
+    JOIN students s ON g.student_id = s.id
+    JOIN classes c ON s.class_id = c.id
+    WHERE g.id IN ({placeholders})
+    ON CONFLICT(grade_level, exam_name, subject) DO UPDATE SET dirty = 1
+"""
+
+GRADE_STATS_REFRESH_SQL = """
+    UPDATE grade_stats
+    SET score_count = agg.score_count, score_sum = agg.score_sum,
+        score_min = agg.score_min, score_max = agg.score_max,
+        score_median = agg.score_median, score_histogram = agg.score_histogram, dirty = 0
+    FROM (
+        SELECT class_id, exam_name, subject,
+               SUM(score_count) AS score_count, SUM(score * score_count) AS score_sum,
+               MIN(score) AS score_min, MAX(score) AS score_max,
+               AVG(CASE WHEN (total + 1) / 2 BETWEEN first_pos AND last_pos
+                          OR (total + 2) / 2 BETWEEN first_pos AND last_pos THEN score END) AS score_median,
+               json_group_object(CAST(score AS TEXT), score_count) AS score_histogram
+        FROM (
+            SELECT class_id, exam_name, subject, score, score_count,
+                   SUM(score_count) OVER w - score_count + 1 AS first_pos,
+                   SUM(score_count) OVER w AS last_pos,
+                   SUM(score_count) OVER (PARTITION BY class_id, exam_name, subject) AS total
+            FROM (
+                SELECT t.class_id, t.exam_name, t.subject, g.score, COUNT(*) AS score_count
+                FROM grade_stats t
+                JOIN students s ON s.class_id = t.class_id
+                JOIN grades g ON g.student_id = s.id AND g.exam_name = t.exam_name AND g.subject = t.subject
+                WHERE t.dirty = 1
+                GROUP BY t.class_id, t.exam_name, t.subject, g.score
+            )
+            WINDOW w AS (PARTITION BY class_id, exam_name, subject ORDER BY score)
+        )
+        GROUP BY class_id, exam_name, subject
+    ) AS agg
+    WHERE grade_stats.class_id = agg.class_id
+      AND grade_stats.exam_name = agg.exam_name
+      AND grade_stats.subject = agg.subject
+"""
+
+GRADE_LEVEL_STATS_REFRESH_SQL = """
+    UPDATE grade_level_stats
+    SET score_count = agg.score_count, score_sum = agg.score_sum,
+        score_histogram = agg.score_histogram, dirty = 0
+    FROM (
+        SELECT grade_level, exam_name, subject,
+               SUM(score_count) AS score_count, SUM(CAST(score_key AS REAL) * score_count) AS score_sum,
+               json_group_object(score_key, score_count) AS score_histogram
+        FROM (
+            -- 合并各班直方图：按分数累加人数
+            SELECT t.grade_level, t.exam_name, t.subject, bin.key AS score_key, SUM(bin.value) AS score_count
+            FROM grade_level_stats t
+            JOIN classes c ON c.grade_level = t.grade_level
+            JOIN grade_stats gs ON gs.class_id = c.id AND gs.exam_name = t.exam_name AND gs.subject = t.subject
+            JOIN json_each(gs.score_histogram) AS bin
+            WHERE t.dirty = 1
+            GROUP BY t.grade_level, t.exam_name, t.subject, bin.key
+        )
+        GROUP BY grade_level, exam_name, subject
+    ) AS agg
+    WHERE grade_level_stats.grade_level = agg.grade_level
+      AND grade_level_stats.exam_name = agg.exam_name
+      AND grade_level_stats.subject = agg.subject
+"""
+
+# 班级数据版本号：成绩变更时递增，分析结果缓存以版本号判断是否失效
+CLASS_VERSION_BUMP_SQL = """
+    INSERT INTO class_versions (class_id, version)
+    SELECT DISTINCT s.class_id, 1
+    FROM grades g
+    JOIN students s ON g.student_id = s.id
+    WHERE g.id IN ({placeholders})
+    ON CONFLICT(class_id) DO UPDATE SET version = version + 1
+"""
+
+def mark_grade_changes_statements(db, grade_ids):
+    """生成标记成绩变更影响范围的语句（汇总表待重算行、班级数据版本号）"""
+    statements = []
+    for chunk in chunked(list(grade_ids), D1_MAX_BOUND_PARAMS):
+        placeholders = ', '.join(['?'] * len(chunk))
+        statements.append(db.prepare(GRADE_STATS_MARK_SQL.format(placeholders=placeholders)).bind(*chunk))
+        statements.append(db.prepare(GRADE_LEVEL_STATS_MARK_SQL.format(placeholders=placeholders)).bind(*chunk))
+        statements.append(db.prepare(CLASS_VERSION_BUMP_SQL.format(placeholders=placeholders)).bind(*chunk))
+    return statements
+
+def refresh_stats_statements(db):
+    """生成重算被标记汇总行的语句（不再有成绩的行直接删除）"""
+    return [
+        db.prepare(GRADE_STATS_REFRESH_SQL),
+        db.prepare("DELETE FROM grade_stats WHERE dirty = 1"),
+        db.prepare(GRADE_LEVEL_STATS_REFRESH_SQL),
+        db.prepare("DELETE FROM grade_level_stats WHERE dirty = 1"),
+    ]
+
+def rebuild_stats(env):
+    """从成绩表完整重建汇总表：清空后将所有分组标记为待重算"""
     db = env['DB']
-    query = """
-        INSERT INTO classes (id, grade_level, class_name) 
-        VALUES (?, ?, ?)
-        ON CONFLICT(id) DO UPDATE SET 
-            grade_level = excluded.grade_level,
-            class_name = excluded.class_name
-    """
-    db.prepare(query).bind(class_id, grade_level, class_name).run()
+    db.batch([
+        db.prepare("DELETE FROM grade_stats"),
+        db.prepare("DELETE FROM grade_level_stats"),
+        db.prepare("""
+            INSERT INTO grade_stats (class_id, exam_name, subject, score_count, score_sum, dirty)
+            SELECT DISTINCT s.class_id, g.exam_name, g.subject, 0, 0, 1
+            FROM grades g
+            JOIN students s ON g.student_id = s.id
+        """),
+        db.prepare("""
+            INSERT INTO grade_level_stats (grade_level, exam_name, subject, score_count, score_sum, dirty)
+            SELECT DISTINCT c.grade_level, gs.exam_name, gs.subject, 0, 0, 1
+            FROM grade_stats gs
+            JOIN classes c ON gs.class_id = c.id
+        """),
+    ] + refresh_stats_statements(db) + [
+        db.prepare("UPDATE class_versions SET version = version + 1"),
+    ])
+    result = db.prepare("SELECT COUNT(*) AS group_count FROM grade_stats").first()
+    return result['group_count'] if result else 0
+
+# D1访问层：按SQL文本缓存预编译语句（每个isolate一份），并统计每个请求的查询次数、耗时和返回行数。
+# handle_request 在处理请求期间把 env['DB'] 替换为 InstrumentedDB，各数据操作函数无需改动
+STATEMENT_CACHE_SIZE = 256
+statement_cache = {'db': None, 'statements': OrderedDict()}
+
+class QueryStats:
+    """单个请求的数据库访问统计"""
+    __slots__ = ('queries', 'round_trips', 'rows', 'duration')
+    
+    def __init__(self):
+        self.queries = 0  # 执行的语句数（batch中的每条语句都计数）
+        self.round_trips = 0  # 与D1的往返次数（一次batch计一次）
+        self.rows = 0
+        self.duration = 0.0  # 秒
+    
+    def record(self, queries, rows, started):
+        self.queries += queries
+        self.round_trips += 1
+        self.rows += rows
+        self.duration += time.perf_counter() - started
+    
+    def server_timing(self):
+        """生成 Server-Timing 响应头"""
+        return (f'db;dur={self.duration * 1000:.1f};'
+                f'desc="queries={self.queries} round_trips={self.round_trips} rows={self.rows}"')
+
+class InstrumentedStatement:
+    """包装D1预编译语句，执行时记录统计"""
+    __slots__ = ('statement', 'stats')
+    
+    def __init__(self, statement, stats):
+        self.statement = statement
+        self.stats = stats
+    
+    def bind(self, *params):
+        return InstrumentedStatement(self.statement.bind(*params), self.stats)
+    
+    # 执行失败的语句同样计入统计（返回行数记为0），耗时包含失败前的等待
+    def all(self):
+        started = time.perf_counter()
+        rows = 0
+        try:
+            result = self.statement.all()
+            rows = len(result)
+            return result
+        finally:
+            self.stats.record(1, rows, started)
+    
+    def first(self):
+        started = time.perf_counter()
+        rows = 0
+        try:
+            result = self.statement.first()
+            rows = 1 if result else 0
+            return result
+        finally:
+            self.stats.record(1, rows, started)
+    
+    def run(self):
+        started = time.perf_counter()
+        try:
+            return self.statement.run()
+        finally:
+            self.stats.record(1, 0, started)
+
+class InstrumentedDB:
+    """包装 env['DB']：复用预编译语句并记录查询统计"""
+    
+    def __init__(self, db, stats=None):
+        self.db = db
+        self.stats = stats or QueryStats()
+    
+    def prepare(self, sql):
+        # 未绑定参数的预编译语句可重复使用，bind() 返回新的语句对象
+        if statement_cache['db'] is not self.db:
+            statement_cache['db'] = self.db
+            statement_cache['statements'].clear()
+        statements = statement_cache['statements']
+        statement = statements.get(sql)
+        if statement is None:
+            statement = statements[sql] = self.db.prepare(sql)
+            if len(statements) > STATEMENT_CACHE_SIZE:
+                statements.popitem(last=False)
+        else:
+            statements.move_to_end(sql)
+        return InstrumentedStatement(statement, self.stats)
     
-    # 查询并返回创建的班级
-    result = db.prepare("SELECT * FROM classes WHERE id = ?").bind(class_id).all()
-    return result[0] if result else None
+    def batch(self, statements):
+        started = time.perf_counter()
+        rows = 0
+        try:
+            results = self.db.batch([statement.statement for statement in statements])
+            rows = sum(len(result) for result in results)
+            return results
+        finally:
+            self.stats.record(len(statements), rows, started)
 
+# D1数据库操作函数
 def get_class(env, class_id):
     """获取班级信息"""
     db = env['DB']
     result = db.prepare("SELECT * FROM classes WHERE id = ?").bind(class_id).first()
     return result
 
-def create_student(env, student_id, name, student_number, class_id):
-    """创建学生"""
+def get_class_version(env, class_id):
+    """获取班级数据版本号"""
+    db = env['DB']
+    result = db.prepare("SELECT version FROM class_versions WHERE class_id = ?").bind(class_id).first()
+    return result['version'] if result else 0
+
+def get_grade_level_version(env, class_id):
+    """获取班级所在年级的数据版本号（年级内各班版本号之和，任一班级变更都会使其增大）"""
     db = env['DB']
     query = """
-        INSERT INTO students (id, name, student_number, class_id) 
-        VALUES (?, ?, ?, ?)
-        ON CONFLICT(id) DO UPDATE SET 
-            name = excluded.name,
-            student_number = excluded.student_number,
-            class_id = excluded.class_id
+        SELECT COALESCE(SUM(v.version), 0) AS version
+        FROM classes c
+        JOIN classes peer ON peer.grade_level = c.grade_level
+        JOIN class_versions v ON v.class_id = peer.id
+        WHERE c.id = ?
     """
-    db.prepare(query).bind(student_id, name, student_number, class_id).run()
-    
-    # 查询并返回创建的学生
-    result = db.prepare("SELECT * FROM students WHERE id = ?").bind(student_id).all()
-    return result[0] if result else None
+    result = db.prepare(query).bind(class_id).first()
+    return result['version'] if result else 0
 
 def get_student(env, student_id):
     """获取学生信息"""
@@ -166,31 +573,21 @@ def get_student(env, student_id):
     result = db.prepare("SELECT * FROM students WHERE id = ?").bind(student_id).first()
     return result
 
-def get_students_by_class(env, class_id):
-    """根据班级ID获取学生列表"""
+def get_students_by_ids(env, student_ids):
+    """批量获取学生信息，返回以学生ID为键的字典（各分块查询在一次batch往返中执行）"""
     db = env['DB']
-    result = db.prepare("SELECT * FROM students WHERE class_id = ?").bind(class_id).all()
-    return result
+    statements = []
+    for chunk in chunked(list(dict.fromkeys(student_ids)), D1_MAX_BOUND_PARAMS):
+        query = f"SELECT * FROM students WHERE id IN ({', '.join(['?'] * len(chunk))})"
+        statements.append(db.prepare(query).bind(*chunk))
+    results = db.batch(statements) if statements else []
+    return {student['id']: student for rows in results for student in rows}
 
-def create_grade(env, grade_id, student_id, subject, score, exam_date, exam_name, teacher_id):
-    """创建成绩记录"""
+def count_students_by_class(env, class_id):
+    """统计班级学生人数"""
     db = env['DB']
-    query = """
-        INSERT INTO grades (id, student_id, subject, score, exam_date, exam_name, teacher_id) 
-        VALUES (?, ?, ?, ?, ?, ?, ?)
-        ON CONFLICT(id) DO UPDATE SET 
-            student_id = excluded.student_id,
-            subject = excluded.subject,
-            score = excluded.score,
-            exam_date = excluded.exam_date,
-            exam_name = excluded.exam_name,
-            teacher_id = excluded.teacher_id
-    """
-    db.prepare(query).bind(grade_id, student_id, subject, score, exam_date, exam_name, teacher_id).run()
-    
-    # 查询并返回创建的成绩记录
-    result = db.prepare("SELECT * FROM grades WHERE id = ?").bind(grade_id).all()
-    return result[0] if result else None
+    result = db.prepare("SELECT COUNT(*) AS student_count FROM students WHERE class_id = ?").bind(class_id).first()
+    return result['student_count'] if result else 0
 
 def get_grade(env, grade_id):
     """获取成绩记录"""
@@ -198,66 +595,555 @@ def get_grade(env, grade_id):
     result = db.prepare("SELECT * FROM grades WHERE id = ?").bind(grade_id).first()
     return result
 
+# 热点查询的SQL（init_db.py 的执行计划检查使用同一份SQL）
+GRADES_BY_STUDENT_SQL = "SELECT * FROM grades WHERE student_id = ? ORDER BY exam_date"
+
+GRADES_BY_CLASS_AND_EXAM_SQL = """
+    SELECT g.*, s.name as student_name, s.student_number
+    FROM grades g
+    JOIN students s ON g.student_id = s.id
+    WHERE s.class_id = ? AND g.exam_name = ?
+    ORDER BY s.name
+"""
+
 def get_grades_by_student(env, student_id):
     """根据学生ID获取成绩列表"""
     db = env['DB']
-    result = db.prepare("SELECT * FROM grades WHERE student_id = ? ORDER BY exam_date").bind(student_id).all()
+    result = db.prepare(GRADES_BY_STUDENT_SQL).bind(student_id).all()
     return result
 
 def get_grades_by_class_and_exam(env, class_id, exam_name):
     """根据班级ID和考试名称获取成绩列表"""
     db = env['DB']
+    result = db.prepare(GRADES_BY_CLASS_AND_EXAM_SQL).bind(class_id, exam_name).all()
+    return result
+
+# 成绩列表可选返回的字段及对应的SQL表达式
+GRADE_LIST_FIELDS = OrderedDict([
+    ('id', 'g.id'),
+    ('student_id', 'g.student_id'),
+    ('subject', 'g.subject'),
+    ('score', 'g.score'),
+    ('exam_date', 'g.exam_date'),
+    ('exam_name', 'g.exam_name'),
+    ('teacher_id', 'g.teacher_id'),
+    ('student_name', 's.name'),
+    ('student_number', 's.student_number'),
+    ('class_id', 's.class_id'),
+])
+GRADE_LIST_DEFAULT_LIMIT = 100
+GRADE_LIST_MAX_LIMIT = 1000
+
+def encode_grade_cursor(grade):
+    """将最后一行的 (exam_date, id) 编码为分页游标"""
+    payload = json.dumps([grade['exam_date'], grade['id']]).encode('utf-8')
+    return base64.urlsafe_b64encode(payload).decode('ascii').rstrip('=')
+
+def decode_grade_cursor(cursor):
+    """解析分页游标，返回 (exam_date, id)，格式错误时抛出 ValueError
+    
+    游标必须是两个字符串组成的JSON数组（exam_date 与成绩id均为TEXT列）
+    """
+    try:
+        payload = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        value = json.loads(payload)
+    except (TypeError, ValueError, UnicodeDecodeError) as e:
+        raise ValueError('Invalid cursor') from e
+    if not (isinstance(value, list) and len(value) == 2 and all(isinstance(item, str) for item in value)):
+        raise ValueError('Invalid cursor')
+    exam_date, grade_id = value
+    return exam_date, grade_id
+
+def build_grade_list_query(filters, select_fields, cursor=None):
+    """构造按 (exam_date, id) 键集分页的成绩查询，返回 (SQL, 参数)，LIMIT 的参数由调用方追加"""
+    columns = ', '.join(f"{GRADE_LIST_FIELDS[field]} AS {field}" for field in select_fields)
+    
+    joins = ["JOIN students s ON g.student_id = s.id"]
+    conditions = []
+    params = []
+    
+    # 班级/年级条件加一元 + 使其不走 students/classes 上的索引，规划器才会按 (exam_date, id)
+    # 顺序扫描成绩索引并在取够 LIMIT 行后停止，而不是取出整个班级的成绩再用临时B树排序
+    if filters.get('grade_level') is not None:
+        joins.append("JOIN classes c ON s.class_id = c.id")
+        conditions.append("+c.grade_level = ?")
+        params.append(filters['grade_level'])
+    for key, condition in (
+        ('class_id', "+s.class_id = ?"),
+        ('exam_name', "g.exam_name = ?"),
+        ('subject', "g.subject = ?"),
+        ('date_from', "g.exam_date >= ?"),
+        ('date_to', "g.exam_date <= ?"),
+    ):
+        if filters.get(key) is not None:
+            conditions.append(condition)
+            params.append(filters[key])
+    if cursor is not None:
+        conditions.append("(g.exam_date, g.id) > (?, ?)")
+        params.extend(cursor)
+    
+    query = f"""
+        SELECT {columns}
+        FROM grades g
+        {' '.join(joins)}
+        {'WHERE ' + ' AND '.join(conditions) if conditions else ''}
+        ORDER BY g.exam_date, g.id
+        LIMIT ?
+    """
+    return query, params
+
+def list_grades(env, filters, fields=None, limit=GRADE_LIST_DEFAULT_LIMIT, cursor=None):
+    """按 (exam_date, id) 键集分页查询成绩
+    
+    filters 支持 class_id、grade_level、exam_name、subject、date_from、date_to；
+    fields 为返回字段列表（默认全部），返回 (成绩列表, 下一页游标)
+    """
+    db = env['DB']
+    fields = list(fields or GRADE_LIST_FIELDS)
+    
+    # 游标需要 exam_date 和 id，未请求时查询后再去掉
+    select_fields = fields + [field for field in ('exam_date', 'id') if field not in fields]
+    query, params = build_grade_list_query(filters, select_fields, cursor)
+    
+    # 多取一行判断是否还有下一页
+    rows = db.prepare(query).bind(*params, limit + 1).all()
+    
+    next_cursor = encode_grade_cursor(rows[limit - 1]) if len(rows) > limit else None
+    rows = rows[:limit]
+    if len(select_fields) > len(fields):
+        rows = [{field: row[field] for field in fields} for row in rows]
+    return rows, next_cursor
+
+LATEST_GRADES_BY_CLASS_SQL = """
+    SELECT student_id, subject, score, exam_date FROM (
+        SELECT g.student_id, g.subject, g.score, g.exam_date,
+               ROW_NUMBER() OVER (
+                   PARTITION BY g.student_id, g.subject
+                   ORDER BY g.exam_date DESC, g.rowid
+               ) AS row_num
+        FROM grades g
+        JOIN students s ON g.student_id = s.id
+        WHERE s.class_id = ?
+    )
+    WHERE row_num = 1
+"""
+
+def get_latest_grades_by_class(env, class_id):
+    """获取班级每个学生每个科目的最新成绩（同一日期取最先录入的记录）"""
+    db = env['DB']
+    result = db.prepare(LATEST_GRADES_BY_CLASS_SQL).bind(class_id).all()
+    return result
+
+GRADE_LEVEL_CLASSES_SQL = """
+    SELECT c.id, c.grade_level, c.class_name, COUNT(s.id) AS student_count
+    FROM classes c
+    LEFT JOIN students s ON s.class_id = c.id
+    WHERE c.grade_level = ?
+    GROUP BY c.id
+    ORDER BY c.id
+"""
+
+LATEST_GRADES_BY_GRADE_LEVEL_SQL = """
+    SELECT class_id, subject, score FROM (
+        SELECT s.class_id, g.subject, g.score,
+               ROW_NUMBER() OVER (
+                   PARTITION BY g.student_id, g.subject
+                   ORDER BY g.exam_date DESC, g.rowid
+               ) AS row_num
+        FROM classes c
+        JOIN students s ON s.class_id = c.id
+        JOIN grades g ON g.student_id = s.id
+        WHERE c.grade_level = ?
+    )
+    WHERE row_num = 1
+"""
+
+def get_latest_grades_by_grade_level(env, grade_level):
+    """获取年级各班级信息、学生人数及每个学生每个科目的最新成绩（两条查询在一次batch往返中完成）
+    
+    返回 (班级列表, 最新成绩列表)
+    """
+    db = env['DB']
+    class_rows, grade_rows = db.batch([
+        db.prepare(GRADE_LEVEL_CLASSES_SQL).bind(grade_level),
+        db.prepare(LATEST_GRADES_BY_GRADE_LEVEL_SQL).bind(grade_level),
+    ])
+    return class_rows, grade_rows
+
+GRADE_LEVEL_CLASS_AVERAGES_SQL = """
+    SELECT c.id AS class_id, c.class_name,
+           SUM(gs.score_sum) / SUM(gs.score_count) AS average,
+           SUM(gs.score_count) AS score_count,
+           RANK() OVER (ORDER BY SUM(gs.score_sum) / SUM(gs.score_count) DESC) AS rank
+    FROM grade_stats gs
+    JOIN classes c ON gs.class_id = c.id
+    WHERE c.grade_level = ? AND gs.exam_name = ?
+    GROUP BY c.id, c.class_name
+    ORDER BY rank
+"""
+
+GRADE_LEVEL_SUBJECT_STATS_SQL = """
+    SELECT subject, score_count, score_sum, score_histogram
+    FROM grade_level_stats
+    WHERE grade_level = ? AND exam_name = ?
+"""
+
+def get_grade_level_comparison(env, grade_level, exam_name):
+    """从汇总表获取年级各班平均分、排名及年级各科目汇总（两条查询在一次batch往返中完成）
+    
+    返回 (各班平均分列表, 年级各科目汇总列表)
+    """
+    db = env['DB']
+    class_rows, subject_rows = db.batch([
+        db.prepare(GRADE_LEVEL_CLASS_AVERAGES_SQL).bind(grade_level, exam_name),
+        db.prepare(GRADE_LEVEL_SUBJECT_STATS_SQL).bind(grade_level, exam_name),
+    ])
+    return class_rows, subject_rows
+
+def get_grade_stats(env, class_id, exam_name):
+    """从汇总表获取班级某次考试各科目的统计数据"""
+    db = env['DB']
     query = """
-        SELECT g.*, s.name as student_name, s.student_number 
-        FROM grades g 
-        JOIN students s ON g.student_id = s.id 
-        WHERE s.class_id = ? AND g.exam_name = ?
-        ORDER BY s.name
+        SELECT subject, score_count, score_sum, score_min, score_max, score_median, score_histogram
+        FROM grade_stats
+        WHERE class_id = ? AND exam_name = ?
     """
     result = db.prepare(query).bind(class_id, exam_name).all()
     return result
 
+def get_class_score_rows(env, class_id, exam_name=None):
+    """获取班级的 学生×科目 分数矩阵，返回 {学生ID: {科目: 分数}}
+    
+    指定考试时取该次考试成绩，否则取各科最新成绩
+    """
+    if exam_name:
+        grades = get_grades_by_class_and_exam(env, class_id, exam_name)
+    else:
+        grades = get_latest_grades_by_class(env, class_id)
+    
+    score_rows = {}
+    for grade in grades:
+        score_rows.setdefault(grade['student_id'], {})[grade['subject']] = grade['score']
+    return score_rows
+
+def build_partial_update(table, key_column, key, values):
+    """构造只更新非None字段的 UPDATE ... RETURNING * 语句
+    
+    values 为 {列名: 新值}（列名由调用方给定），没有需要更新的字段时返回 None，否则返回 (query, params)
+    """
+    updates = {column: value for column, value in values.items() if value is not None}
+    if not updates:
+        return None
+    
+    assignments = ', '.join(f"{column} = ?" for column in updates)
+    query = f"UPDATE {table} SET {assignments} WHERE {key_column} = ? RETURNING *"
+    return query, list(updates.values()) + [key]
+
 def update_grade(env, grade_id, subject=None, score=None, exam_date=None, exam_name=None):
     """更新成绩记录"""
     db = env['DB']
     
-    # 构建动态更新查询
-    updates = []
-    params = []
-    
-    if subject is not None:
-        updates.append("subject = ?")
-        params.append(subject)
-    if score is not None:
-        updates.append("score = ?")
-        params.append(score)
-    if exam_date is not None:
-        updates.append("exam_date = ?")
-        params.append(exam_date)
-    if exam_name is not None:
-        updates.append("exam_name = ?")
-        params.append(exam_name)
-    
-    if updates:
-        query = f"UPDATE grades SET {', '.join(updates)} WHERE id = ?"
-        params.append(grade_id)
-        db.prepare(query).bind(*params).run()
+    update = build_partial_update('grades', 'id', grade_id, {
+        'subject': subject,
+        'score': score,
+        'exam_date': exam_date,
+        'exam_name': exam_name,
+    })
+    if update is None:
+        return get_grade(env, grade_id)
+    
+    query, params = update
+    # 更新前后所属的汇总行都需要重算
+    before = mark_grade_changes_statements(db, [grade_id])
+    results = db.batch(
+        before
+        + [db.prepare(query).bind(*params)]
+        + mark_grade_changes_statements(db, [grade_id])
+        + refresh_stats_statements(db)
+    )
     
     # 返回更新后的记录
-    return get_grade(env, grade_id)
+    grade_rows = results[len(before)]
+    return grade_rows[0] if grade_rows else None
 
 def delete_grade(env, grade_id):
-    """删除成绩记录"""
+    """删除成绩记录，返回被删除的记录（不存在时返回 None）"""
     db = env['DB']
-    result = get_grade(env, grade_id)
-    if result:
-        db.prepare("DELETE FROM grades WHERE id = ?").bind(grade_id).run()
-        return result
-    return None
+    before = mark_grade_changes_statements(db, [grade_id])
+    results = db.batch(
+        before
+        + [db.prepare("DELETE FROM grades WHERE id = ? RETURNING *").bind(grade_id)]
+        + refresh_stats_statements(db)
+    )
+    grade_rows = results[len(before)]
+    return grade_rows[0] if grade_rows else None
+
+def build_multi_row_insert(prefix, row_count, column_count, suffix=''):
+    """构造多行VALUES的INSERT语句"""
+    placeholders = '(' + ', '.join(['?'] * column_count) + ')'
+    return f"{prefix} VALUES {', '.join([placeholders] * row_count)} {suffix}"
+
+# 成绩的自然键为 (student_id, subject, exam_name)：同一学生同一科目同一次考试只有一条成绩。
+# 写入模式：insert 拒绝已存在的成绩（逐条报告冲突，其余成绩照常写入），upsert 更新分数或考试日期有变化的成绩，
+# skip-existing 保留已存在的成绩只插入新成绩
+GRADE_WRITE_MODES = ('insert', 'upsert', 'skip-existing')
+
+GRADE_CONFLICT_CLAUSES = {
+    'insert': "",
+    'upsert': """
+        ON CONFLICT(student_id, subject, exam_name) DO UPDATE SET
+            score = excluded.score,
+            exam_date = excluded.exam_date,
+            teacher_id = excluded.teacher_id
+        WHERE grades.score IS NOT excluded.score OR grades.exam_date IS NOT excluded.exam_date
+    """,
+    'skip-existing': "ON CONFLICT(student_id, subject, exam_name) DO NOTHING",
+}
+
+# 被拒绝写入的成绩状态及对应的错误信息
+GRADE_REJECTED_STATUSES = {
+    'conflict': 'Grade already exists',
+    'student_number_conflict': 'Student number already belongs to another student',
+    'student_class_missing': 'Student does not exist and no class is available to create it',
+}
+
+SCORE_MIN = 0
+SCORE_MAX = 100
+
+def parse_score(value):
+    """解析分数，非数值、NaN/无穷大或超出 SCORE_MIN-SCORE_MAX 时抛出 ValueError"""
+    try:
+        score = float(value)
+    except (TypeError, ValueError):
+        raise ValueError('Invalid score')
+    if not math.isfinite(score) or not SCORE_MIN <= score <= SCORE_MAX:
+        raise ValueError(f'Score must be between {SCORE_MIN} and {SCORE_MAX}')
+    return score
+
+def grade_natural_key(grade):
+    """成绩元组 (id, student_id, subject, score, exam_date, exam_name, teacher_id) 的自然键"""
+    return grade[1], grade[2], grade[5]
+
+def build_grade_key_lookup(key_count):
+    """构造按自然键批量查询成绩的SQL
+    
+    以VALUES列表联表查询，每个自然键走唯一索引（行值 IN (VALUES ...) 会退化为全表扫描）
+    """
+    return f"""
+        WITH k(student_id, subject, exam_name) AS (VALUES {', '.join(['(?, ?, ?)'] * key_count)})
+        SELECT g.* FROM k
+        JOIN grades g ON g.student_id = k.student_id AND g.subject = k.subject AND g.exam_name = k.exam_name
+    """
+
+def prefetch_grade_write_targets(env, students, keys):
+    """预取学生、新学生学号的占用情况和按自然键已存在的成绩（学生一次batch往返，其余一次batch往返）
+    
+    students 为 {学生ID: (id, name, student_number, class_id)}。
+    返回 (已存在的学生ID集合, {被其他学生占用的新学生学号: 占用者ID}, {(student_id, subject, exam_name): 成绩记录})
+    """
+    db = env['DB']
+    existing_students = set(get_students_by_ids(env, students))
+    
+    statements = []
+    new_numbers = [row[2] for sid, row in students.items() if sid not in existing_students]
+    for chunk in chunked(list(dict.fromkeys(new_numbers)), D1_MAX_BOUND_PARAMS):
+        query = f"SELECT id, student_number FROM students WHERE student_number IN ({', '.join(['?'] * len(chunk))})"
+        statements.append(db.prepare(query).bind(*chunk))
+    number_statement_count = len(statements)
+    for chunk in chunked(keys, D1_MAX_BOUND_PARAMS // 3):
+        query = build_grade_key_lookup(len(chunk))
+        statements.append(db.prepare(query).bind(*[value for key in chunk for value in key]))
+    
+    results = db.batch(statements) if statements else []
+    taken_numbers = {row['student_number']: row['id'] for rows in results[:number_statement_count] for row in rows}
+    existing_grades = {
+        (row['student_id'], row['subject'], row['exam_name']): row
+        for rows in results[number_statement_count:]
+        for row in rows
+    }
+    return existing_students, taken_numbers, existing_grades
+
+def write_grades(env, students, grades, mode='upsert', dry_run=False, atomic=False):
+    """按自然键写入成绩：预取学生和已有成绩并比对，一次batch只写入新增和有变化的成绩
+    （补全学生、多行写入成绩、只标记并重算变化成绩所属的汇总行）
+    
+    students 为 {学生ID: (id, name, student_number, class_id)}，grades 为
+    (id, student_id, subject, score, exam_date, exam_name, teacher_id) 列表，自然键不能重复；
+    insert 模式下已存在的成绩状态为 conflict 且不写入；学生不存在且学号已被其他学生占用时
+    状态为 student_number_conflict，学生不存在且没有可用班级（class_id 为 None）时状态为
+    student_class_missing，这两种情况都不创建该学生也不写入其成绩；其余成绩照常写入。atomic 为 True 时
+    只要有成绩被拒绝就不写入任何数据；dry_run 时只比对不写入。
+    返回与 grades 一一对应的 (状态, 写入前的记录, 写入后的记录) 列表，状态为 inserted / updated / unchanged
+    或 GRADE_REJECTED_STATUSES 中的拒绝状态，未写入的新增和有变化的成绩没有写入后的记录
+    """
+    db = env['DB']
+    keys = [grade_natural_key(grade) for grade in grades]
+    existing_students, taken_numbers, existing_grades = prefetch_grade_write_targets(env, students, keys)
+    # 无法创建的新学生：{学生ID: 拒绝状态}
+    rejected_students = {}
+    for sid, row in students.items():
+        if sid in existing_students:
+            continue
+        if row[3] is None:
+            rejected_students[sid] = 'student_class_missing'
+        elif row[2] in taken_numbers:
+            rejected_students[sid] = 'student_number_conflict'
+    
+    # 按预取结果分类，只写入新增和有变化的成绩
+    statuses = []
+    changed = []
+    for grade, key in zip(grades, keys):
+        current = existing_grades.get(key)
+        if grade[1] in rejected_students:
+            statuses.append(rejected_students[grade[1]])
+        elif current is not None and mode == 'insert':
+            statuses.append('conflict')
+        elif current is None:
+            statuses.append('inserted')
+            changed.append(grade)
+        elif mode == 'upsert' and (current['score'] != grade[3] or current['exam_date'] != grade[4]):
+            statuses.append('updated')
+            changed.append(grade)
+        else:
+            statuses.append('unchanged')
+    
+    if atomic and any(status in GRADE_REJECTED_STATUSES for status in statuses):
+        dry_run = True
+    
+    rows = dict(existing_grades)
+    if changed and not dry_run:
+        statements = []
+        
+        # 补全缺失的学生（学号冲突的学生已被拒绝；只忽略ID冲突，学号冲突仍会使batch失败而不是留下孤立成绩）
+        missing_students = [
+            row for sid, row in students.items()
+            if sid not in existing_students and sid not in rejected_students
+        ]
+        for chunk in chunked(missing_students, D1_MAX_BOUND_PARAMS // 4):
+            query = build_multi_row_insert(
+                "INSERT INTO students (id, name, student_number, class_id)",
+                len(chunk), 4, "ON CONFLICT(id) DO NOTHING"
+            )
+            statements.append(db.prepare(query).bind(*[value for row in chunk for value in row]))
+        
+        # 多行写入成绩，冲突处理由写入模式决定
+        first_grade_statement = len(statements)
+        for chunk in chunked(changed, D1_MAX_BOUND_PARAMS // 7):
+            query = build_multi_row_insert(
+                "INSERT INTO grades (id, student_id, subject, score, exam_date, exam_name, teacher_id)",
+                len(chunk), 7, GRADE_CONFLICT_CLAUSES[mode] + " RETURNING *"
+            )
+            statements.append(db.prepare(query).bind(*[value for row in chunk for value in row]))
+        grade_statement_count = len(statements) - first_grade_statement
+        
+        # 更新的成绩保留原ID；自然键不变，所属汇总行也不变，写入后标记即可
+        changed_ids = [
+            existing_grades[grade_natural_key(grade)]['id'] if grade_natural_key(grade) in existing_grades
+            else grade[0]
+            for grade in changed
+        ]
+        statements.extend(mark_grade_changes_statements(db, changed_ids))
+        statements.extend(refresh_stats_statements(db))
+        
+        # D1的batch在单个事务中执行，失败时整体回滚
+        results = db.batch(statements)
+        for written in results[first_grade_statement:first_grade_statement + grade_statement_count]:
+            for row in written:
+                rows[(row['student_id'], row['subject'], row['exam_name'])] = row
+    
+    if dry_run:
+        return [
+            (status, existing_grades.get(key), existing_grades.get(key) if status == 'unchanged' else None)
+            for status, key in zip(statuses, keys)
+        ]
+    return [
+        (status, existing_grades.get(key), None if status in GRADE_REJECTED_STATUSES else rows.get(key))
+        for status, key in zip(statuses, keys)
+    ]
+
+def count_write_statuses(results):
+    """统计写入结果中各状态的数量（被拒绝的成绩不计入）"""
+    counts = {'inserted': 0, 'updated': 0, 'unchanged': 0}
+    for status, _, _ in results:
+        if status in counts:
+            counts[status] += 1
+    return counts
+
+def bulk_import_grades(env, rows, user, mode='upsert', dry_run=False):
+    """批量导入成绩：按自然键与已有成绩比对，只写入新增和分数或日期有变化的行
+    
+    rows 为 (行号, 数据字典) 列表。同一批次内自然键重复的行只保留第一行；不同批次间的重复行
+    不单独跟踪（内存不随文件大小增长），由后一批次按 mode 处理：upsert 覆盖，insert 报告冲突。
+    分数等字段在组装batch之前逐行校验，无效行按行号记录错误，不影响同一批次的其他行。
+    返回 ({inserted, updated, unchanged}, 变更明细列表, errors)
+    """
+    errors = []
+    changes = []
+    default_class_id = user.get('class_id', 'class_1')  # 默认班级
+    key_lines = {}
+    
+    # 校验并转换每一行，错误按行号记录；自然键重复的行只保留第一行
+    students = {}
+    grades = []
+    for line_no, data in rows:
+        try:
+            student_id = data['学号']
+            grade = (
+                str(uuid.uuid4()),
+                student_id,
+                data['科目'],
+                parse_score(data['分数']),
+                data['考试日期'],
+                data['考试名称'],
+                user['user_id']
+            )
+        except Exception as e:
+            errors.append(f"Line {line_no}: {str(e)}")
+            continue
+        key = grade_natural_key(grade)
+        if key in key_lines:
+            errors.append(f"Line {line_no}: Duplicate of line {key_lines[key]}")
+            continue
+        key_lines[key] = line_no
+        grades.append(grade)
+        students.setdefault(student_id, (student_id, data['学生姓名'], student_id, default_class_id))
+    
+    counts = {'inserted': 0, 'updated': 0, 'unchanged': 0}
+    if not grades:
+        return counts, changes, errors
+    
+    try:
+        results = write_grades(env, students, grades, mode, dry_run)
+    except Exception as e:
+        errors.append(f"Import failed: {str(e)}")
+        return counts, changes, errors
+    
+    # 变更明细：新增行和分数/日期有变化的行（附原值）；被拒绝的行按行号记录错误
+    for grade, (status, previous, _) in zip(grades, results):
+        if status in GRADE_REJECTED_STATUSES:
+            errors.append(f"Line {key_lines[grade_natural_key(grade)]}: {GRADE_REJECTED_STATUSES[status]}")
+            continue
+        if status == 'unchanged':
+            continue
+        change = {
+            'line': key_lines[grade_natural_key(grade)],
+            'status': status,
+            'student_id': grade[1],
+            'subject': grade[2],
+            'exam_name': grade[5],
+            'score': grade[3],
+            'exam_date': grade[4]
+        }
+        if previous is not None:
+            change['previous_score'] = previous['score']
+            change['previous_exam_date'] = previous['exam_date']
+        changes.append(change)
+    
+    return count_write_statuses(results), changes, errors
 
 # API处理函数
 @require_auth
-def on_request_grades(env, request):
+def on_request_grades(env, request, params):
     """处理成绩相关请求"""
     user = env['user']
     role = user['role']
@@ -271,10 +1157,10 @@ def on_request_grades(env, request):
         return on_get_class_grades(env, request, user)
     elif request.method == 'PUT':
         # 更新成绩
-        return on_put_grade(env, request, user)
+        return on_put_grade(env, request, user, params)
     elif request.method == 'DELETE':
         # 删除成绩
-        return on_delete_grade(env, request, user)
+        return on_delete_grade(env, request, user, params)
     else:
         return {
             'status': 405,
@@ -282,62 +1168,32 @@ def on_request_grades(env, request):
             'body': json.dumps({'error': 'Method not allowed'})
         }
 
-def on_post_grade(env, request, user):
-    """处理录入成绩请求"""
-    role = user['role']
-    if role not in ['teacher', 'admin']:
-        return {
-            'status': 403,
-            'headers': {'Content-Type': 'application/json'},
-            'body': json.dumps({'error': 'Permission denied'})
-        }
-    
-    # 解析请求体
-    body = request.body.read().decode('utf-8')
-    data = json.loads(body) if body else {}
-    
-    # 验证必要字段
-    required_fields = ['student_name', 'student_id', 'subject', 'score', 'exam_date', 'exam_name']
-    for field in required_fields:
+GRADE_REQUIRED_FIELDS = ['student_name', 'student_id', 'subject', 'score', 'exam_date', 'exam_name']
+GRADE_BATCH_MAX_ITEMS = 1000
+
+def parse_grade_item(data, user):
+    """校验录入的成绩对象，返回 (成绩元组, 学生元组)，无效时抛出 ValueError"""
+    if not isinstance(data, dict):
+        raise ValueError('Grade must be an object')
+    for field in GRADE_REQUIRED_FIELDS:
         if field not in data:
-            return {
-                'status': 400,
-                'headers': {'Content-Type': 'application/json'},
-                'body': json.dumps({'error': f'Missing required field: {field}'})
-            }
-    
-    # 创建学生（如果不存在）
-    student = get_student(env, data['student_id'])
-    if not student:
-        student = create_student(
-            env,
-            data['student_id'],
-            data['student_name'],
-            data['student_id'],
-            user.get('class_id', 'class_1')  # 默认班级
-        )
+            raise ValueError(f'Missing required field: {field}')
+    score = parse_score(data['score'])
     
-    # 创建成绩记录
-    grade_id = str(uuid.uuid4())
-    grade = create_grade(
-        env,
-        grade_id,
+    grade = (
+        str(uuid.uuid4()),
         data['student_id'],
         data['subject'],
-        float(data['score']),
+        score,
         data['exam_date'],
         data['exam_name'],
         user['user_id']
     )
-    
-    return {
-        'status': 201,
-        'headers': {'Content-Type': 'application/json'},
-        'body': json.dumps({'success': True, 'grade': grade})
-    }
+    student = (data['student_id'], data['student_name'], data['student_id'], user.get('class_id', 'class_1'))  # 默认班级
+    return grade, student
 
-def on_put_grade(env, request, user):
-    """处理更新成绩请求"""
+def on_post_grade(env, request, user):
+    """处理录入成绩请求（?mode= 指定 insert / upsert / skip-existing，默认 upsert）"""
     role = user['role']
     if role not in ['teacher', 'admin']:
         return {
@@ -346,85 +1202,117 @@ def on_put_grade(env, request, user):
             'body': json.dumps({'error': 'Permission denied'})
         }
     
-    # 解析URL获取成绩ID
-    url = request.url
-    path_parts = url.split('/')
-    if len(path_parts) < 5:
+    mode = parse_query_params(request.url).get('mode', 'upsert')
+    if mode not in GRADE_WRITE_MODES:
         return {
             'status': 400,
             'headers': {'Content-Type': 'application/json'},
-            'body': json.dumps({'error': 'Missing grade ID in URL'})
+            'body': json.dumps({'error': f"mode must be one of: {', '.join(GRADE_WRITE_MODES)}"})
         }
     
-    grade_id = path_parts[4]  # /api/grades/<GRADE_ID>
-    
-    # 解析请求体
+    # 解析请求体：只接受JSON对象（单条或 {"grades": [...]} 信封）或数组
     body = request.body.read().decode('utf-8')
-    data = json.loads(body) if body else {}
+    try:
+        data = json.loads(body) if body else {}
+    except ValueError:
+        data = None
+    if not isinstance(data, (dict, list)):
+        return {
+            'status': 400,
+            'headers': {'Content-Type': 'application/json'},
+            'body': json.dumps({'error': 'Request body must be a JSON object or array'})
+        }
     
-    # 更新成绩记录
-    grade = update_grade(
-        env,
-        grade_id,
-        subject=data.get('subject'),
-        score=float(data['score']) if 'score' in data else None,
-        exam_date=data.get('exam_date'),
-        exam_name=data.get('exam_name')
-    )
+    # 数组或 {"grades": [...]} 信封：批量录入
+    if isinstance(data, list):
+        return on_post_grades_batch(env, data, user, mode)
+    if isinstance(data.get('grades'), list):
+        return on_post_grades_batch(env, data['grades'], user, mode)
     
-    if not grade:
+    # 验证必要字段
+    try:
+        grade, student = parse_grade_item(data, user)
+    except ValueError as e:
         return {
-            'status': 404,
+            'status': 400,
             'headers': {'Content-Type': 'application/json'},
-            'body': json.dumps({'error': 'Grade not found'})
+            'body': json.dumps({'error': str(e)})
+        }
+    
+    # 写入成绩记录（学生不存在时一并创建）
+    [(status, _, grade)] = write_grades(env, {student[0]: student}, [grade], mode)
+    if status in GRADE_REJECTED_STATUSES:
+        return {
+            'status': 400 if status == 'student_class_missing' else 409,
+            'headers': {'Content-Type': 'application/json'},
+            'body': json.dumps({'error': GRADE_REJECTED_STATUSES[status]})
         }
     
     return {
-        'status': 200,
+        'status': 201 if status == 'inserted' else 200,
         'headers': {'Content-Type': 'application/json'},
-        'body': json.dumps({'success': True, 'grade': grade})
+        'body': json.dumps({'success': True, 'status': status, 'grade': grade})
     }
 
-def on_delete_grade(env, request, user):
-    """处理删除成绩请求"""
-    role = user['role']
-    if role not in ['teacher', 'admin']:
+def on_post_grades_batch(env, items, user, mode):
+    """处理批量录入成绩请求：先校验全部条目，任一条目无效时不写入；全部有效时在一个batch事务中写入"""
+    if not items or len(items) > GRADE_BATCH_MAX_ITEMS:
         return {
-            'status': 403,
+            'status': 400,
             'headers': {'Content-Type': 'application/json'},
-            'body': json.dumps({'error': 'Permission denied'})
+            'body': json.dumps({'error': f'grades must contain 1 to {GRADE_BATCH_MAX_ITEMS} items'})
         }
     
-    # 解析URL获取成绩ID
-    url = request.url
-    path_parts = url.split('/')
-    if len(path_parts) < 5:
+    students = {}
+    grades = []
+    results = []
+    key_indexes = {}
+    for index, data in enumerate(items):
+        try:
+            grade, student = parse_grade_item(data, user)
+        except ValueError as e:
+            results.append({'index': index, 'success': False, 'error': str(e)})
+            continue
+        key = grade_natural_key(grade)
+        if key in key_indexes:
+            results.append({'index': index, 'success': False, 'error': f'Duplicate of item {key_indexes[key]}'})
+            continue
+        key_indexes[key] = index
+        grades.append(grade)
+        students.setdefault(student[0], student)
+        results.append({'index': index, 'success': True})
+    
+    if len(grades) < len(items):
         return {
             'status': 400,
             'headers': {'Content-Type': 'application/json'},
-            'body': json.dumps({'error': 'Missing grade ID in URL'})
+            'body': json.dumps({'success': False, 'results': results})
         }
     
-    grade_id = path_parts[4]  # /api/grades/<GRADE_ID>
-    
-    # 删除成绩记录
-    grade = delete_grade(env, grade_id)
-    
-    if not grade:
+    written = write_grades(env, students, grades, mode, atomic=True)
+    if any(status in GRADE_REJECTED_STATUSES for status, _, _ in written):
+        for result, (status, _, _) in zip(results, written):
+            if status in GRADE_REJECTED_STATUSES:
+                result.update({'success': False, 'error': GRADE_REJECTED_STATUSES[status]})
         return {
-            'status': 404,
+            'status': 409,
             'headers': {'Content-Type': 'application/json'},
-            'body': json.dumps({'error': 'Grade not found'})
+            'body': json.dumps({'success': False, 'results': results})
         }
     
+    for result, (status, _, grade) in zip(results, written):
+        result['status'] = status
+        result['grade'] = grade
+    counts = count_write_statuses(written)
+    
     return {
-        'status': 200,
+        'status': 201 if counts['inserted'] else 200,
         'headers': {'Content-Type': 'application/json'},
-        'body': json.dumps({'success': True, 'deleted_grade': grade})
+        'body': json.dumps(dict({'success': True, 'results': results}, **counts))
     }
 
-def on_get_class_grades(env, request, user):
-    """处理查询班级成绩请求"""
+def on_put_grade(env, request, user, params):
+    """处理更新成绩请求"""
     role = user['role']
     if role not in ['teacher', 'admin']:
         return {
@@ -433,35 +1321,509 @@ def on_get_class_grades(env, request, user):
             'body': json.dumps({'error': 'Permission denied'})
         }
     
-    # 解析查询参数
-    url = request.url
-    query_params = {}
-    if '?' in url:
-        query_string = url.split('?', 1)[1]
-        query_params = dict(param.split('=') for param in query_string.split('&') if '=' in param)
-    
-    class_id = query_params.get('class_id', user.get('class_id'))
-    exam_name = query_params.get('exam_name')
-    
-    if not class_id or not exam_name:
+    grade_id = params.get('grade_id')  # /api/grades/<GRADE_ID>
+    if not grade_id:
         return {
             'status': 400,
             'headers': {'Content-Type': 'application/json'},
-            'body': json.dumps({'error': 'Missing required query parameters: class_id and exam_name'})
+            'body': json.dumps({'error': 'Missing grade ID in URL'})
         }
     
-    # 获取成绩数据
-    grades = get_grades_by_class_and_exam(env, class_id, exam_name)
-    
-    return {
+    # 解析请求体
+    body = request.body.read().decode('utf-8')
+    try:
+        data = json.loads(body) if body else {}
+    except ValueError:
+        data = None
+    if not isinstance(data, dict):
+        return {
+            'status': 400,
+            'headers': {'Content-Type': 'application/json'},
+            'body': json.dumps({'error': 'Request body must be a JSON object'})
+        }
+    
+    try:
+        score = parse_score(data['score']) if 'score' in data else None
+    except ValueError as e:
+        return {
+            'status': 400,
+            'headers': {'Content-Type': 'application/json'},
+            'body': json.dumps({'error': str(e)})
+        }
+    
+    # 更新成绩记录（修改科目或考试名称后可能与已有成绩的自然键冲突）
+    try:
+        grade = update_grade(
+            env,
+            grade_id,
+            subject=data.get('subject'),
+            score=score,
+            exam_date=data.get('exam_date'),
+            exam_name=data.get('exam_name')
+        )
+    except Exception as e:
+        if 'UNIQUE constraint failed' not in str(e):
+            raise
+        return {
+            'status': 409,
+            'headers': {'Content-Type': 'application/json'},
+            'body': json.dumps({'error': 'Grade already exists for this student, subject and exam'})
+        }
+    
+    if not grade:
+        return {
+            'status': 404,
+            'headers': {'Content-Type': 'application/json'},
+            'body': json.dumps({'error': 'Grade not found'})
+        }
+    
+    return {
         'status': 200,
         'headers': {'Content-Type': 'application/json'},
-        'body': json.dumps({'grades': grades})
+        'body': json.dumps({'success': True, 'grade': grade})
     }
 
+def on_delete_grade(env, request, user, params):
+    """处理删除成绩请求"""
+    role = user['role']
+    if role not in ['teacher', 'admin']:
+        return {
+            'status': 403,
+            'headers': {'Content-Type': 'application/json'},
+            'body': json.dumps({'error': 'Permission denied'})
+        }
+    
+    grade_id = params.get('grade_id')  # /api/grades/<GRADE_ID>
+    if not grade_id:
+        return {
+            'status': 400,
+            'headers': {'Content-Type': 'application/json'},
+            'body': json.dumps({'error': 'Missing grade ID in URL'})
+        }
+    
+    # 删除成绩记录
+    grade = delete_grade(env, grade_id)
+    
+    if not grade:
+        return {
+            'status': 404,
+            'headers': {'Content-Type': 'application/json'},
+            'body': json.dumps({'error': 'Grade not found'})
+        }
+    
+    return {
+        'status': 200,
+        'headers': {'Content-Type': 'application/json'},
+        'body': json.dumps({'success': True, 'deleted_grade': grade})
+    }
+
+def on_get_class_grades(env, request, user):
+    """处理查询班级成绩请求"""
+    role = user['role']
+    if role not in ['teacher', 'admin']:
+        return {
+            'status': 403,
+            'headers': {'Content-Type': 'application/json'},
+            'body': json.dumps({'error': 'Permission denied'})
+        }
+    
+    # 解析查询参数
+    query_params = parse_query_params(request.url)
+    
+    class_id = query_params.get('class_id', user.get('class_id'))
+    exam_name = query_params.get('exam_name')
+    
+    # 指定班级和考试且未分页时保持原有的整班返回
+    if 'limit' not in query_params and 'cursor' not in query_params and class_id and exam_name:
+        grades = get_grades_by_class_and_exam(env, class_id, exam_name)
+        return {
+            'status': 200,
+            'headers': {'Content-Type': 'application/json'},
+            'body': json.dumps({'grades': grades})
+        }
+    
+    return list_grades_response(env, user, query_params)
+
+def list_grades_response(env, user, query_params):
+    """处理分页查询成绩请求（支持按班级、年级、考试、科目和日期范围过滤）"""
+    filters = {
+        key: query_params.get(key)
+        for key in ('class_id', 'exam_name', 'subject', 'date_from', 'date_to')
+    }
+    
+    try:
+        if 'grade_level' in query_params:
+            filters['grade_level'] = int(query_params['grade_level'])
+        limit = int(query_params.get('limit', GRADE_LIST_DEFAULT_LIMIT))
+        cursor = decode_grade_cursor(query_params['cursor']) if 'cursor' in query_params else None
+    except ValueError:
+        return {
+            'status': 400,
+            'headers': {'Content-Type': 'application/json'},
+            'body': json.dumps({'error': 'Invalid query parameters: grade_level, limit or cursor'})
+        }
+    
+    # 教师未指定班级或年级时默认查询本班，管理员可查询全校
+    if user['role'] != 'admin' and not filters['class_id'] and 'grade_level' not in filters:
+        filters['class_id'] = user.get('class_id')
+    
+    if not 1 <= limit <= GRADE_LIST_MAX_LIMIT:
+        return {
+            'status': 400,
+            'headers': {'Content-Type': 'application/json'},
+            'body': json.dumps({'error': f'limit must be between 1 and {GRADE_LIST_MAX_LIMIT}'})
+        }
+    
+    fields = None
+    if query_params.get('fields'):
+        fields = [field.strip() for field in query_params['fields'].split(',') if field.strip()]
+        unknown = [field for field in fields if field not in GRADE_LIST_FIELDS]
+        if unknown:
+            return {
+                'status': 400,
+                'headers': {'Content-Type': 'application/json'},
+                'body': json.dumps({'error': f"Unknown fields: {', '.join(unknown)}"})
+            }
+    
+    grades, next_cursor = list_grades(env, filters, fields, limit, cursor)
+    
+    return {
+        'status': 200,
+        'headers': {'Content-Type': 'application/json'},
+        'body': json.dumps({'grades': grades, 'next_cursor': next_cursor})
+    }
+
+# 上传文件流式解析
+IMPORT_READ_SIZE = 64 * 1024  # 每次从请求体读取的字节数
+IMPORT_CHUNK_ROWS = 500  # 每批写入数据库的行数
+IMPORT_CHANGE_DETAIL_LIMIT = 500  # 导入结果中最多返回的变更明细条数
+IMPORT_ERROR_LIMIT = 100  # 导入结果中最多返回的错误条数，总数见 error_count
+MULTIPART_MAX_HEADER_SIZE = 16 * 1024
+
+def iter_request_body(request, size=IMPORT_READ_SIZE):
+    """分块读取请求体"""
+    while True:
+        chunk = request.body.read(size)
+        if not chunk:
+            break
+        yield chunk
+
+def get_multipart_boundary(content_type):
+    """从Content-Type中解析multipart边界"""
+    match = re.search(r'boundary=(?:"([^"]+)"|([^;\s]+))', content_type)
+    if not match:
+        return None
+    return match.group(1) or match.group(2)
+
+def parse_part_headers(raw_headers):
+    """解析multipart分段头，返回小写键名的字典及Content-Disposition参数"""
+    headers = {}
+    for line in raw_headers.split('\r\n'):
+        if ':' in line:
+            name, value = line.split(':', 1)
+            headers[name.strip().lower()] = value.strip()
+    disposition = headers.get('content-disposition', '')
+    headers['params'] = dict(re.findall(r'(\w+)="([^"]*)"', disposition))
+    return headers
+
+def read_multipart_file(chunks, boundary):
+    """流式定位multipart请求体中的第一个文件分段
+    
+    返回 (分段头, 文件内容的字节块迭代器)；没有文件分段时返回 (None, None)
+    """
+    delimiter = b'\r\n--' + boundary.encode('latin-1')
+    chunks = iter(chunks)
+    buffer = b'\r\n'  # 让第一个边界也带有前导CRLF，统一匹配
+    
+    def fill():
+        nonlocal buffer
+        chunk = next(chunks, b'')
+        buffer += chunk
+        return bool(chunk)
+    
+    while True:
+        # 跳过前导内容或非文件分段，直到下一个边界
+        index = buffer.find(delimiter)
+        while index == -1:
+            buffer = buffer[-(len(delimiter) - 1):]
+            if not fill():
+                return None, None
+            index = buffer.find(delimiter)
+        buffer = buffer[index + len(delimiter):]
+        
+        while len(buffer) < 2 and fill():
+            pass
+        if buffer.startswith(b'--'):
+            return None, None  # 结束边界
+        
+        # 读取分段头
+        end = buffer.find(b'\r\n\r\n')
+        while end == -1:
+            if len(buffer) > MULTIPART_MAX_HEADER_SIZE or not fill():
+                raise ValueError('Malformed multipart body')
+            end = buffer.find(b'\r\n\r\n')
+        headers = parse_part_headers(buffer[:end].decode('utf-8', 'replace'))
+        buffer = buffer[end + 4:]
+        
+        if 'filename' in headers['params']:
+            break
+    
+    def iter_file_content():
+        nonlocal buffer
+        keep = len(delimiter) - 1
+        while True:
+            index = buffer.find(delimiter)
+            if index != -1:
+                if index:
+                    yield buffer[:index]
+                return
+            # 保留可能跨块的边界前缀，其余内容直接输出
+            if len(buffer) > keep:
+                yield buffer[:-keep]
+                buffer = buffer[-keep:]
+            if not fill():
+                raise ValueError('Unexpected end of multipart body')
+    
+    return headers, iter_file_content()
+
+def iter_text_lines(chunks, encoding='utf-8-sig'):
+    """增量解码字节块并按行输出（保留换行符，自动去除BOM）"""
+    decoder = codecs.getincrementaldecoder(encoding)()
+    pending = ''
+    for chunk in chunks:
+        pending += decoder.decode(chunk)
+        lines = pending.split('\n')
+        pending = lines.pop()
+        for line in lines:
+            yield line + '\n'
+    pending += decoder.decode(b'', final=True)
+    if pending:
+        yield pending
+
+# XLSX流式读写
+XLSX_MIME_TYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+XLSX_SPOOL_SIZE = 1024 * 1024  # 上传文件超过此大小时转存临时文件
+XLSX_NS = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+XLSX_REL_NS = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}'
+XLSX_PKG_REL_NS = '{http://schemas.openxmlformats.org/package/2006/relationships}'
+# Excel内置的日期数字格式ID
+XLSX_BUILTIN_DATE_FORMATS = set(range(14, 23)) | {45, 46, 47}
+XLSX_EPOCH = datetime.date(1899, 12, 30)
+
+def xlsx_column_index(cell_ref):
+    """将单元格引用（如 "C12"）转换为从0开始的列序号"""
+    index = 0
+    for char in cell_ref:
+        if not char.isalpha():
+            break
+        index = index * 26 + (ord(char.upper()) - ord('A') + 1)
+    return index - 1
+
+def xlsx_column_letter(index):
+    """将从0开始的列序号转换为列字母"""
+    letters = ''
+    index += 1
+    while index:
+        index, remainder = divmod(index - 1, 26)
+        letters = chr(ord('A') + remainder) + letters
+    return letters
+
+def read_xlsx_shared_strings(archive):
+    """流式读取共享字符串表"""
+    if 'xl/sharedStrings.xml' not in archive.namelist():
+        return []
+    strings = []
+    with archive.open('xl/sharedStrings.xml') as stream:
+        for event, elem in ET.iterparse(stream, events=('end',)):
+            if elem.tag == XLSX_NS + 'si':
+                # 直接文本或富文本片段，忽略拼音注释(rPh)
+                parts = [child.text or '' for child in elem if child.tag == XLSX_NS + 't']
+                for run in elem.findall(XLSX_NS + 'r'):
+                    parts.extend(t.text or '' for t in run.findall(XLSX_NS + 't'))
+                strings.append(''.join(parts))
+                elem.clear()
+    return strings
+
+def read_xlsx_date_styles(archive):
+    """返回日期格式单元格样式的序号集合"""
+    if 'xl/styles.xml' not in archive.namelist():
+        return set()
+    with archive.open('xl/styles.xml') as stream:
+        styles = ET.parse(stream).getroot()
+    date_formats = set(XLSX_BUILTIN_DATE_FORMATS)
+    num_fmts = styles.find(XLSX_NS + 'numFmts')
+    if num_fmts is not None:
+        for fmt in num_fmts:
+            code = re.sub(r'"[^"]*"|\[[^\]]*\]', '', fmt.get('formatCode', '')).lower()
+            if any(token in code for token in ('y', 'd')) or ('m' in code and 'h' not in code and 's' not in code):
+                date_formats.add(int(fmt.get('numFmtId')))
+    cell_xfs = styles.find(XLSX_NS + 'cellXfs')
+    if cell_xfs is None:
+        return set()
+    return {index for index, xf in enumerate(cell_xfs) if int(xf.get('numFmtId', 0)) in date_formats}
+
+def find_xlsx_first_sheet(archive):
+    """根据workbook关系定位第一个工作表的路径"""
+    try:
+        with archive.open('xl/workbook.xml') as stream:
+            sheet = ET.parse(stream).getroot().find(f'{XLSX_NS}sheets/{XLSX_NS}sheet')
+        with archive.open('xl/_rels/workbook.xml.rels') as stream:
+            relations = ET.parse(stream).getroot()
+        rel_id = sheet.get(XLSX_REL_NS + 'id')
+        for relation in relations.iter(XLSX_PKG_REL_NS + 'Relationship'):
+            if relation.get('Id') == rel_id:
+                target = relation.get('Target')
+                return target.lstrip('/') if target.startswith('/') else 'xl/' + target
+    except (KeyError, AttributeError):
+        pass
+    return 'xl/worksheets/sheet1.xml'
+
+def xlsx_cell_value(cell, shared_strings, date_styles):
+    """读取单元格的文本值"""
+    cell_type = cell.get('t', 'n')
+    if cell_type == 'inlineStr':
+        return ''.join(t.text or '' for t in cell.iter(XLSX_NS + 't'))
+    value = cell.findtext(XLSX_NS + 'v')
+    if value is None:
+        return ''
+    if cell_type == 's':
+        return shared_strings[int(value)]
+    if cell_type == 'b':
+        return 'TRUE' if value == '1' else 'FALSE'
+    if cell_type == 'n':
+        number = float(value)
+        if int(cell.get('s', 0)) in date_styles:
+            return (XLSX_EPOCH + datetime.timedelta(days=int(number))).isoformat()
+        if number.is_integer() and 'E' not in value.upper():
+            return str(int(number))
+    return value
+
+def iter_xlsx_rows(file_obj):
+    """流式读取XLSX第一个工作表，逐行输出 (行号, 单元格文本列表)
+    
+    工作表XML使用iterparse逐行解析并及时清理，不构建完整的DOM树
+    """
+    with zipfile.ZipFile(file_obj) as archive:
+        shared_strings = read_xlsx_shared_strings(archive)
+        date_styles = read_xlsx_date_styles(archive)
+        sheet_path = find_xlsx_first_sheet(archive)
+        with archive.open(sheet_path) as stream:
+            sheet_data = None
+            row_number = 0
+            for event, elem in ET.iterparse(stream, events=('start', 'end')):
+                if event == 'start':
+                    if elem.tag == XLSX_NS + 'sheetData':
+                        sheet_data = elem
+                    continue
+                if elem.tag != XLSX_NS + 'row':
+                    continue
+                row_number = int(elem.get('r', row_number + 1))
+                values = []
+                for cell in elem.iter(XLSX_NS + 'c'):
+                    ref = cell.get('r')
+                    column = xlsx_column_index(ref) if ref else len(values)
+                    values.extend([''] * (column - len(values)))
+                    values.append(xlsx_cell_value(cell, shared_strings, date_styles))
+                yield row_number, values
+                # 释放已处理的行
+                if sheet_data is not None:
+                    sheet_data.clear()
+
+def spool_stream(chunks, max_size=XLSX_SPOOL_SIZE):
+    """将字节块写入可随机访问的临时文件（ZIP需要读取末尾的目录）"""
+    spool = tempfile.SpooledTemporaryFile(max_size=max_size)
+    for chunk in chunks:
+        spool.write(chunk)
+    spool.seek(0)
+    return spool
+
+def xlsx_cell_xml(ref, value):
+    """生成单个单元格的XML"""
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return f'<c r="{ref}"><v>{value}</v></c>'
+    text = xml_escape('' if value is None else str(value))
+    return f'<c r="{ref}" t="inlineStr"><is><t xml:space="preserve">{text}</t></is></c>'
+
+def write_xlsx(rows, output, sheet_name='Sheet1'):
+    """将行迭代器流式写入XLSX文件
+    
+    使用内联字符串，逐行写入压缩的工作表，无需在内存中保留全部行
+    """
+    with zipfile.ZipFile(output, 'w', zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr('[Content_Types].xml', (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+            '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+            '<Default Extension="xml" ContentType="application/xml"/>'
+            '<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+            '<Override PartName="/xl/worksheets/sheet1.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+            '</Types>'
+        ))
+        archive.writestr('_rels/.rels', (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+            '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="xl/workbook.xml"/>'
+            '</Relationships>'
+        ))
+        archive.writestr('xl/workbook.xml', (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+            'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+            f'<sheets><sheet name="{xml_escape(sheet_name)}" sheetId="1" r:id="rId1"/></sheets>'
+            '</workbook>'
+        ))
+        archive.writestr('xl/_rels/workbook.xml.rels', (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+            '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" Target="worksheets/sheet1.xml"/>'
+            '</Relationships>'
+        ))
+        with archive.open('xl/worksheets/sheet1.xml', 'w') as sheet:
+            sheet.write(
+                b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                b'<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>'
+            )
+            for row_number, row in enumerate(rows, 1):
+                cells = ''.join(
+                    xlsx_cell_xml(f'{xlsx_column_letter(column)}{row_number}', value)
+                    for column, value in enumerate(row)
+                )
+                sheet.write(f'<row r="{row_number}">{cells}</row>'.encode('utf-8'))
+            sheet.write(b'</sheetData></worksheet>')
+    return output
+
+def is_xlsx_upload(part_headers, first_chunk):
+    """判断上传的文件是否为XLSX"""
+    filename = part_headers['params'].get('filename', '').lower()
+    if filename.endswith('.xlsx') or part_headers.get('content-type', '').startswith(XLSX_MIME_TYPE):
+        return True
+    return first_chunk.startswith(b'PK\x03\x04')
+
+def iter_import_records(part_headers, content):
+    """按文件类型逐条输出导入记录 (行号, 单元格列表)"""
+    content = iter(content)
+    first_chunk = next(content, b'')
+    chunks = itertools.chain([first_chunk], content)
+    
+    if is_xlsx_upload(part_headers, first_chunk):
+        try:
+            with spool_stream(chunks) as spool:
+                yield from iter_xlsx_rows(spool)
+        except (zipfile.BadZipFile, ET.ParseError, KeyError, IndexError) as e:
+            # 缺少工作表等部件(KeyError)、共享字符串索引越界(IndexError)同样视为文件格式错误
+            raise ValueError(str(e))
+        return
+    
+    # CSV：逐条解析记录（支持引号、BOM和CRLF）
+    reader = csv.reader(iter_text_lines(chunks))
+    for values in reader:
+        yield reader.line_num, values
+
 # Excel模板生成和导入功能
+IMPORT_COLUMNS = ['学生姓名', '学号', '科目', '分数', '考试日期', '考试名称']
+
 @require_auth
-def on_request_template(env, request):
+def on_request_template(env, request, params):
     """处理下载成绩导入模板请求"""
     user = env['user']
     role = user['role']
@@ -473,24 +1835,26 @@ def on_request_template(env, request):
             'body': json.dumps({'error': 'Permission denied'})
         }
     
-    # 生成Excel模板内容（简化版本，实际应用中应生成真实的Excel文件）
-    template_content = """学生姓名,学号,科目,分数,考试日期,考试名称
-张三,2023001,数学,95.5,2023-10-15,期中考试
-李四,2023002,数学,87.0,2023-10-15,期中考试
-王五,2023003,数学,92.5,2023-10-15,期中考试
-"""
+    # 生成Excel模板内容
+    template_rows = [
+        IMPORT_COLUMNS,
+        ['张三', '2023001', '数学', 95.5, '2023-10-15', '期中考试'],
+        ['李四', '2023002', '数学', 87.0, '2023-10-15', '期中考试'],
+        ['王五', '2023003', '数学', 92.5, '2023-10-15', '期中考试'],
+    ]
+    template_content = write_xlsx(template_rows, io.BytesIO()).getvalue()
     
     return {
         'status': 200,
         'headers': {
-            'Content-Type': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+            'Content-Type': XLSX_MIME_TYPE,
             'Content-Disposition': 'attachment; filename="grades_template.xlsx"'
         },
         'body': template_content
     }
 
 @require_auth
-def on_request_import_grades(env, request):
+def on_request_import_grades(env, request, params):
     """处理批量导入成绩请求"""
     user = env['user']
     role = user['role']
@@ -502,6 +1866,17 @@ def on_request_import_grades(env, request):
             'body': json.dumps({'error': 'Permission denied'})
         }
     
+    query_params = parse_query_params(request.url)
+    mode = query_params.get('mode', 'upsert')
+    if mode not in GRADE_WRITE_MODES:
+        return {
+            'status': 400,
+            'headers': {'Content-Type': 'application/json'},
+            'body': json.dumps({'error': f"mode must be one of: {', '.join(GRADE_WRITE_MODES)}"})
+        }
+    # dry_run 时只与已有成绩比对并返回变更摘要，不写入
+    dry_run = query_params.get('dry_run', '').lower() in ('1', 'true', 'yes')
+    
     # 检查是否有文件上传
     content_type = request.headers.get('Content-Type', '')
     if 'multipart/form-data' not in content_type:
@@ -511,80 +1886,107 @@ def on_request_import_grades(env, request):
             'body': json.dumps({'error': 'Missing file upload'})
         }
     
-    # 解析上传的文件（简化版本，实际应用中需要解析真实的Excel文件）
-    # 这里我们假设文件内容已经被解析并作为文本传递
-    body = request.body.read().decode('utf-8')
-    
-    # 简化的CSV解析（实际应用中应使用专门的Excel解析库）
-    lines = body.strip().split('\n')
-    if len(lines) < 2:
+    boundary = get_multipart_boundary(content_type)
+    if not boundary:
         return {
             'status': 400,
             'headers': {'Content-Type': 'application/json'},
-            'body': json.dumps({'error': 'Invalid file format'})
+            'body': json.dumps({'error': 'Missing file upload'})
         }
     
-    # 解析标题行
-    headers = lines[0].split(',')
-    required_headers = ['学生姓名', '学号', '科目', '分数', '考试日期', '考试名称']
-    for header in required_headers:
-        if header not in headers:
-            return {
-                'status': 400,
-                'headers': {'Content-Type': 'application/json'},
-                'body': json.dumps({'error': f'Missing required column: {header}'})
-            }
+    try:
+        part_headers, content = read_multipart_file(iter_request_body(request), boundary)
+    except ValueError as e:
+        return {
+            'status': 400,
+            'headers': {'Content-Type': 'application/json'},
+            'body': json.dumps({'error': str(e)})
+        }
+    if part_headers is None:
+        return {
+            'status': 400,
+            'headers': {'Content-Type': 'application/json'},
+            'body': json.dumps({'error': 'Missing file upload'})
+        }
     
-    # 解析数据行
-    imported_count = 0
-    errors = []
+    # 逐条解析CSV或XLSX记录
+    records = iter_import_records(part_headers, content)
     
-    for i, line in enumerate(lines[1:], 1):
-        try:
-            values = line.split(',')
+    try:
+        headers = [header.strip() for header in next(records, (0, []))[1]]
+        for header in IMPORT_COLUMNS:
+            if header not in headers:
+                return {
+                    'status': 400,
+                    'headers': {'Content-Type': 'application/json'},
+                    'body': json.dumps({'error': f'Missing required column: {header}'})
+                }
+        
+        # 解析数据行，按固定大小分批写入
+        counts = {'inserted': 0, 'updated': 0, 'unchanged': 0}
+        changes = []
+        errors = []
+        error_count = 0
+        row_count = 0
+        rows = []
+        
+        for line_no, values in records:
+            if not any(values):
+                continue  # 跳过空行
+            row_count += 1
+            if len(values) > len(headers) and not any(values[len(headers):]):
+                values = values[:len(headers)]  # 忽略末尾多余的空单元格
             if len(values) != len(headers):
-                errors.append(f"Line {i+1}: Column count mismatch")
+                error_count += 1
+                if len(errors) < IMPORT_ERROR_LIMIT:
+                    errors.append(f"Line {line_no}: Column count mismatch")
                 continue
+            rows.append((line_no, dict(zip(headers, values))))
             
-            # 创建数据字典
-            data = dict(zip(headers, values))
-            
-            # 创建学生（如果不存在）
-            student = get_student(env, data['学号'])
-            if not student:
-                student = create_student(
-                    env,
-                    data['学号'],
-                    data['学生姓名'],
-                    data['学号'],
-                    user.get('class_id', 'class_1')  # 默认班级
-                )
-            
-            # 创建成绩记录
-            grade_id = str(uuid.uuid4())
-            grade = create_grade(
-                env,
-                grade_id,
-                data['学号'],
-                data['科目'],
-                float(data['分数']),
-                data['考试日期'],
-                data['考试名称'],
-                user['user_id']
-            )
-            
-            imported_count += 1
-        except Exception as e:
-            errors.append(f"Line {i+1}: {str(e)}")
+            if len(rows) >= IMPORT_CHUNK_ROWS:
+                chunk_counts, chunk_changes, chunk_errors = bulk_import_grades(env, rows, user, mode, dry_run)
+                for status, count in chunk_counts.items():
+                    counts[status] += count
+                changes.extend(chunk_changes[:IMPORT_CHANGE_DETAIL_LIMIT - len(changes)])
+                error_count += len(chunk_errors)
+                errors.extend(chunk_errors[:IMPORT_ERROR_LIMIT - len(errors)])
+                rows = []
+        
+        if rows:
+            chunk_counts, chunk_changes, chunk_errors = bulk_import_grades(env, rows, user, mode, dry_run)
+            for status, count in chunk_counts.items():
+                counts[status] += count
+            changes.extend(chunk_changes[:IMPORT_CHANGE_DETAIL_LIMIT - len(changes)])
+            error_count += len(chunk_errors)
+            errors.extend(chunk_errors[:IMPORT_ERROR_LIMIT - len(errors)])
+    except (ValueError, csv.Error) as e:
+        return {
+            'status': 400,
+            'headers': {'Content-Type': 'application/json'},
+            'body': json.dumps({'error': f'Invalid file format: {str(e)}'})
+        }
+    
+    if row_count == 0:
+        return {
+            'status': 400,
+            'headers': {'Content-Type': 'application/json'},
+            'body': json.dumps({'error': 'Invalid file format'})
+        }
     
     # 返回结果
-    result = {
+    # 变更摘要：各状态计数和变更明细（明细最多 IMPORT_CHANGE_DETAIL_LIMIT 条，错误最多 IMPORT_ERROR_LIMIT 条）
+    result = dict({
         'success': True,
-        'imported_count': imported_count
-    }
+        'dry_run': dry_run,
+        'imported_count': 0 if dry_run else counts['inserted'] + counts['updated'],
+        'changes': changes,
+        'changes_truncated': counts['inserted'] + counts['updated'] > len(changes)
+    }, **counts)
     
     if errors:
         result['errors'] = errors
+        result['error_count'] = error_count
+        result['errors_truncated'] = error_count > len(errors)
     
     return {
         'status': 200,
@@ -592,10 +1994,53 @@ def on_request_import_grades(env, request):
         'body': json.dumps(result)
     }
 
-# 数据分析功能
+def parse_query_params(url):
+    """解析URL查询参数（自动URL解码，重复参数取第一个值）"""
+    if '?' not in url:
+        return {}
+    query_string = url.split('?', 1)[1]
+    return {key: values[0] for key, values in parse_qs(query_string).items()}
+
+# 流式导出每次从数据库读取的行数
+EXPORT_PAGE_SIZE = 1000
+EXPORT_FIELDS = ['student_name', 'student_id', 'subject', 'score', 'exam_date', 'exam_name']
+EXPORT_FORMATS = {
+    'csv': 'text/csv; charset=utf-8',
+    'ndjson': 'application/x-ndjson',
+}
+
+def iter_grade_pages(env, filters, fields, page_size=EXPORT_PAGE_SIZE):
+    """按游标逐页读取成绩，内存中最多保留一页"""
+    cursor = None
+    while True:
+        grades, next_cursor = list_grades(env, filters, fields, page_size, cursor)
+        if grades:
+            yield grades
+        if next_cursor is None:
+            return
+        cursor = decode_grade_cursor(next_cursor)
+
+def iter_ndjson_export(pages):
+    """每页成绩输出为NDJSON文本块"""
+    for grades in pages:
+        yield ''.join(json.dumps(grade) + '\n' for grade in grades)
+
+def iter_csv_export(pages):
+    """每页成绩输出为CSV文本块（表头与导入模板一致，带BOM便于Excel识别编码）"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(IMPORT_COLUMNS)
+    yield '\ufeff' + buffer.getvalue()
+    
+    for grades in pages:
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows([grade[field] for field in EXPORT_FIELDS] for grade in grades)
+        yield buffer.getvalue()
+
 @require_auth
-def on_request_analysis_class(env, request):
-    """处理班级总体分析请求"""
+def on_request_export_grades(env, request, params):
+    """处理导出成绩请求（XLSX导出单个班级的一次考试，CSV/NDJSON按班级、考试或年级流式导出）"""
     user = env['user']
     role = user['role']
     
@@ -606,120 +2051,170 @@ def on_request_analysis_class(env, request):
             'body': json.dumps({'error': 'Permission denied'})
         }
     
-    # 解析URL参数获取班级ID
-    url = request.url
-    path_parts = url.split('/')
-    if len(path_parts) < 8:
-        return {
-            'status': 400,
-            'headers': {'Content-Type': 'application/json'},
-            'body': json.dumps({'error': 'Missing class ID in URL'})
-        }
+    query_params = parse_query_params(request.url)
+    # 格式由扩展名（/api/export/grades.csv）或 format 参数指定，默认XLSX
+    path = urlsplit(request.url).path
+    export_format = query_params.get('format', path.rsplit('.', 1)[1] if '.' in path else 'xlsx')
     
-    class_id = path_parts[7]  # /api/analysis/class/<CLASS_ID>
+    if export_format in EXPORT_FORMATS:
+        return stream_grades_export(env, user, query_params, export_format)
     
-    # 获取班级信息
-    class_info = get_class(env, class_id)
-    if not class_info:
+    if export_format != 'xlsx':
         return {
-            'status': 404,
+            'status': 400,
             'headers': {'Content-Type': 'application/json'},
-            'body': json.dumps({'error': 'Class not found'})
+            'body': json.dumps({'error': f'Unsupported export format: {export_format}'})
         }
     
-    # 获取班级中的所有学生
-    students = get_students_by_class(env, class_id)
-    if not students:
+    class_id = query_params.get('class_id', user.get('class_id'))
+    exam_name = query_params.get('exam_name')
+    
+    if not class_id or not exam_name:
         return {
-            'status': 404,
+            'status': 400,
             'headers': {'Content-Type': 'application/json'},
-            'body': json.dumps({'error': 'No students found in class'})
+            'body': json.dumps({'error': 'Missing required query parameters: class_id and exam_name'})
         }
     
-    # 获取所有学生的最新成绩（按科目分组）
-    subject_scores = {}
-    for student in students:
-        student_grades = get_grades_by_student(env, student['id'])
-        # 按科目分组，保留最新成绩
-        latest_grades = {}
-        for grade in student_grades:
-            subject = grade['subject']
-            exam_date = grade['exam_date']
-            if subject not in latest_grades or exam_date > latest_grades[subject]['exam_date']:
-                latest_grades[subject] = grade
-        
-        # 将最新成绩按科目分组
-        for subject, grade in latest_grades.items():
-            if subject not in subject_scores:
-                subject_scores[subject] = []
-            subject_scores[subject].append(grade['score'])
-    
-    # 计算各科目的统计指标
-    analysis_result = {
-        'class_info': class_info,
-        'student_count': len(students),
-        'subject_analysis': {}
-    }
+    grades = get_grades_by_class_and_exam(env, class_id, exam_name)
     
-    for subject, scores in subject_scores.items():
-        if scores:
-            analysis_result['subject_analysis'][subject] = {
-                'average': round(sum(scores) / len(scores), 2),
-                'median': statistics.median(scores),
-                'min': min(scores),
-                'max': max(scores),
-                'count': len(scores)
-            }
+    # 导出列与导入模板一致，导出的文件可直接重新导入
+    rows = itertools.chain([IMPORT_COLUMNS], (
+        [grade[field] for field in EXPORT_FIELDS]
+        for grade in grades
+    ))
+    content = write_xlsx(rows, io.BytesIO()).getvalue()
     
     return {
         'status': 200,
-        'headers': {'Content-Type': 'application/json'},
-        'body': json.dumps(analysis_result)
+        'headers': {
+            'Content-Type': XLSX_MIME_TYPE,
+            'Content-Disposition': 'attachment; filename="grades.xlsx"'
+        },
+        'body': content
     }
 
-@require_auth
-def on_request_analysis_student_longitudinal(env, request):
-    """处理学生纵向趋势分析请求"""
-    user = env['user']
-    role = user['role']
+def stream_grades_export(env, user, query_params, export_format):
+    """按游标分页读取成绩并逐页写入响应体（生成器），内存占用与导出总行数无关"""
+    filters = {
+        key: query_params.get(key)
+        for key in ('class_id', 'exam_name', 'subject', 'date_from', 'date_to')
+    }
+    if 'grade_level' in query_params:
+        try:
+            filters['grade_level'] = int(query_params['grade_level'])
+        except ValueError:
+            return {
+                'status': 400,
+                'headers': {'Content-Type': 'application/json'},
+                'body': json.dumps({'error': 'Invalid query parameter: grade_level'})
+            }
+    
+    # 未指定范围时教师默认导出本班
+    if not filters['class_id'] and 'grade_level' not in filters:
+        filters['class_id'] = user.get('class_id')
     
-    # 解析URL参数获取学生ID
-    url = request.url
-    path_parts = url.split('/')
-    if len(path_parts) < 9:
+    if not filters['class_id'] and not filters['exam_name'] and 'grade_level' not in filters:
         return {
             'status': 400,
             'headers': {'Content-Type': 'application/json'},
-            'body': json.dumps({'error': 'Missing student ID in URL'})
+            'body': json.dumps({'error': 'Missing export scope: class_id, exam_name or grade_level'})
         }
     
-    student_id = path_parts[8]  # /api/analysis/student/longitudinal/<STUDENT_ID>
+    pages = iter_grade_pages(env, filters, EXPORT_FIELDS)
+    body = iter_csv_export(pages) if export_format == 'csv' else iter_ndjson_export(pages)
     
-    # 检查权限：学生只能查看自己的数据，教师和管理员可以查看所有数据
-    if role == 'student' and user['user_id'] != student_id:
-        return {
-            'status': 403,
-            'headers': {'Content-Type': 'application/json'},
-            'body': json.dumps({'error': 'Permission denied'})
-        }
+    return {
+        'status': 200,
+        'headers': {
+            'Content-Type': EXPORT_FORMATS[export_format],
+            'Content-Disposition': f'attachment; filename="grades.{export_format}"'
+        },
+        'body': body
+    }
+
+# 数据分析功能
+class AnalysisNotFoundError(Exception):
+    """分析所需的数据不存在"""
+
+def compute_class_analysis(env, class_id, exam_name=None):
+    """计算班级总体分析（指定考试时读取汇总表，否则基于各学生最新成绩）"""
+    # 获取班级信息
+    class_info = get_class(env, class_id)
+    if not class_info:
+        raise AnalysisNotFoundError('Class not found')
+    
+    # 获取班级学生人数
+    student_count = count_students_by_class(env, class_id)
+    if not student_count:
+        raise AnalysisNotFoundError('No students found in class')
+    
+    analysis_result = {
+        'class_info': class_info,
+        'student_count': student_count,
+        'subject_analysis': {}
+    }
+    
+    # 指定考试时直接读取汇总表
+    if exam_name:
+        analysis_result['exam_name'] = exam_name
+        for stats in get_grade_stats(env, class_id, exam_name):
+            histogram = ScoreHistogram.from_json(stats['score_histogram'])
+            analysis_result['subject_analysis'][stats['subject']] = {
+                'average': round(stats['score_sum'] / stats['score_count'], 2),
+                'median': stats['score_median'],
+                'min': stats['score_min'],
+                'max': stats['score_max'],
+                'count': stats['score_count'],
+                'percentiles': histogram.percentiles()
+            }
+        return analysis_result
+    
+    # 一次查询获取所有学生各科目的最新成绩，按科目累加到直方图
+    subject_histograms = {}
+    for grade in get_latest_grades_by_class(env, class_id):
+        subject_histograms.setdefault(grade['subject'], ScoreHistogram()).add(grade['score'])
+    
+    # 计算各科目的统计指标
+    for subject, histogram in subject_histograms.items():
+        analysis_result['subject_analysis'][subject] = histogram.summary()
     
+    return analysis_result
+
+def compute_grade_level_class_analyses(env, grade_level):
+    """一次查询计算年级内所有班级的总体分析（结构与 compute_class_analysis 一致，跳过没有学生的班级）"""
+    class_rows, grade_rows = get_latest_grades_by_grade_level(env, grade_level)
+    
+    subject_histograms = {}
+    for grade in grade_rows:
+        class_histograms = subject_histograms.setdefault(grade['class_id'], {})
+        class_histograms.setdefault(grade['subject'], ScoreHistogram()).add(grade['score'])
+    
+    analyses = []
+    for row in class_rows:
+        if not row['student_count']:
+            continue
+        analyses.append({
+            'class_info': {'id': row['id'], 'grade_level': row['grade_level'], 'class_name': row['class_name']},
+            'student_count': row['student_count'],
+            'subject_analysis': {
+                subject: histogram.summary()
+                for subject, histogram in subject_histograms.get(row['id'], {}).items()
+            }
+        })
+    return analyses
+
+def compute_student_trend(env, student_id):
+    """计算学生各科目的成绩趋势"""
     # 获取学生信息
     student = get_student(env, student_id)
     if not student:
-        return {
-            'status': 404,
-            'headers': {'Content-Type': 'application/json'},
-            'body': json.dumps({'error': 'Student not found'})
-        }
+        raise AnalysisNotFoundError('Student not found')
     
     # 获取学生的所有成绩记录
     grades = get_grades_by_student(env, student_id)
     if not grades:
-        return {
-            'status': 404,
-            'headers': {'Content-Type': 'application/json'},
-            'body': json.dumps({'error': 'No grades found for student'})
-        }
+        raise AnalysisNotFoundError('No grades found for student')
     
     # 按科目分组成绩
     subject_grades = {}
@@ -755,42 +2250,89 @@ def on_request_analysis_student_longitudinal(env, request):
                 'last_score': last_score
             }
     
+    return trend_analysis
+
+@require_auth
+@cache_analysis_response('class')
+def on_request_analysis_class(env, request, params):
+    """处理班级总体分析请求"""
+    user = env['user']
+    role = user['role']
+    
+    if role not in ['teacher', 'admin']:
+        return {
+            'status': 403,
+            'headers': {'Content-Type': 'application/json'},
+            'body': json.dumps({'error': 'Permission denied'})
+        }
+    
+    class_id = params['class_id']  # /api/analysis/class/<CLASS_ID>
+    exam_name = parse_query_params(request.url).get('exam')
+    
+    try:
+        analysis_result = compute_class_analysis(env, class_id, exam_name)
+    except AnalysisNotFoundError as e:
+        return {
+            'status': 404,
+            'headers': {'Content-Type': 'application/json'},
+            'body': json.dumps({'error': str(e)})
+        }
+    
     return {
         'status': 200,
         'headers': {'Content-Type': 'application/json'},
-        'body': json.dumps(trend_analysis)
+        'body': json.dumps(analysis_result)
     }
 
 @require_auth
-def on_request_analysis_comparison(env, request):
-    """处理横向对比分析请求"""
+def on_request_analysis_student_longitudinal(env, request, params):
+    """处理学生纵向趋势分析请求"""
     user = env['user']
     role = user['role']
     
-    if role not in ['teacher', 'admin']:
+    student_id = params['student_id']  # /api/analysis/student/longitudinal/<STUDENT_ID>
+    
+    # 检查权限：学生只能查看自己的数据，教师和管理员可以查看所有数据
+    if role == 'student' and user['user_id'] != student_id:
         return {
             'status': 403,
             'headers': {'Content-Type': 'application/json'},
             'body': json.dumps({'error': 'Permission denied'})
         }
     
-    # 解析URL参数获取班级ID和考试名称
-    url = request.url
-    path_parts = url.split('/')
-    if len(path_parts) < 8:
+    try:
+        trend_analysis = compute_student_trend(env, student_id)
+    except AnalysisNotFoundError as e:
+        return {
+            'status': 404,
+            'headers': {'Content-Type': 'application/json'},
+            'body': json.dumps({'error': str(e)})
+        }
+    
+    return {
+        'status': 200,
+        'headers': {'Content-Type': 'application/json'},
+        'body': json.dumps(trend_analysis)
+    }
+
+@require_auth
+@cache_analysis_response('grade_level')
+def on_request_analysis_comparison(env, request, params):
+    """处理横向对比分析请求"""
+    user = env['user']
+    role = user['role']
+    
+    if role not in ['teacher', 'admin']:
         return {
-            'status': 400,
+            'status': 403,
             'headers': {'Content-Type': 'application/json'},
-            'body': json.dumps({'error': 'Missing class ID in URL'})
+            'body': json.dumps({'error': 'Permission denied'})
         }
     
-    class_id = path_parts[7]  # /api/analysis/comparison/<CLASS_ID>
+    class_id = params['class_id']  # /api/analysis/comparison/<CLASS_ID>
     
     # 解析查询参数
-    query_params = {}
-    if '?' in url:
-        query_string = url.split('?', 1)[1]
-        query_params = dict(param.split('=') for param in query_string.split('&') if '=' in param)
+    query_params = parse_query_params(request.url)
     
     exam_name = query_params.get('exam')
     if not exam_name:
@@ -822,16 +2364,22 @@ def on_request_analysis_comparison(env, request):
     class_scores = [grade['score'] for grade in class_grades]
     class_average = sum(class_scores) / len(class_scores) if class_scores else 0
     
-    # 简化处理：假设年级只有一个班级，实际应用中需要查询所有班级
-    grade_level_average = class_average  # 在实际应用中，这应该是年级所有班级的平均分
+    # 查询年级内所有班级的平均分和排名，年级平均分取自年级汇总表
+    class_rows, subject_rows = get_grade_level_comparison(env, class_info['grade_level'], exam_name)
+    grade_score_count = sum(row['score_count'] for row in subject_rows)
+    if grade_score_count:
+        grade_level_average = sum(row['score_sum'] for row in subject_rows) / grade_score_count
+    else:
+        grade_level_average = class_average  # 汇总表尚未生成时退化为班级平均分
+    class_rank = next((row['rank'] for row in class_rows if row['class_id'] == class_id), None)
     
-    # 按学生分组成绩
+    # 按学生分组成绩（联表结果中已包含学生姓名）
     student_scores = {}
+    student_names = {}
     for grade in class_grades:
         student_id = grade['student_id']
-        if student_id not in student_scores:
-            student_scores[student_id] = []
-        student_scores[student_id].append(grade['score'])
+        student_scores.setdefault(student_id, []).append(grade['score'])
+        student_names[student_id] = grade['student_name']
     
     # 计算每个学生的平均分
     student_averages = {}
@@ -847,6 +2395,25 @@ def on_request_analysis_comparison(env, request):
         'exam_name': exam_name,
         'class_average': round(class_average, 2),
         'grade_level_average': round(grade_level_average, 2),
+        'grade_level_subject_averages': {
+            row['subject']: round(row['score_sum'] / row['score_count'], 2)
+            for row in subject_rows if row['score_count']
+        },
+        'grade_level_subject_stats': {
+            row['subject']: ScoreHistogram.from_json(row['score_histogram']).summary()
+            for row in subject_rows if row['score_count']
+        },
+        'class_rank': class_rank,
+        'class_count': len(class_rows),
+        'class_averages': [
+            {
+                'class_id': row['class_id'],
+                'class_name': row['class_name'],
+                'average': round(row['average'], 2),
+                'rank': row['rank']
+            }
+            for row in class_rows
+        ],
         'student_count': len(student_scores),
         'above_average_count': len(above_average),
         'below_average_count': len(below_average),
@@ -855,15 +2422,13 @@ def on_request_analysis_comparison(env, request):
     
     # 添加学生详细信息
     for student_id, average in student_averages.items():
-        student = get_student(env, student_id)
-        if student:
-            comparison_result['student_details'].append({
-                'student_id': student_id,
-                'student_name': student['name'],
-                'average_score': round(average, 2),
-                'difference_from_class': round(average - class_average, 2),
-                'difference_from_grade': round(average - grade_level_average, 2)
-            })
+        comparison_result['student_details'].append({
+            'student_id': student_id,
+            'student_name': student_names[student_id],
+            'average_score': round(average, 2),
+            'difference_from_class': round(average - class_average, 2),
+            'difference_from_grade': round(average - grade_level_average, 2)
+        })
     
     return {
         'status': 200,
@@ -872,7 +2437,8 @@ def on_request_analysis_comparison(env, request):
     }
 
 @require_auth
-def on_request_analysis_correlation(env, request):
+@cache_analysis_response('class')
+def on_request_analysis_correlation(env, request, params):
     """处理学科关联分析请求"""
     user = env['user']
     role = user['role']
@@ -884,23 +2450,10 @@ def on_request_analysis_correlation(env, request):
             'body': json.dumps({'error': 'Permission denied'})
         }
     
-    # 解析URL参数获取班级ID
-    url = request.url
-    path_parts = url.split('/')
-    if len(path_parts) < 8:
-        return {
-            'status': 400,
-            'headers': {'Content-Type': 'application/json'},
-            'body': json.dumps({'error': 'Missing class ID in URL'})
-        }
-    
-    class_id = path_parts[7]  # /api/analysis/correlation/<CLASS_ID>
+    class_id = params['class_id']  # /api/analysis/correlation/<CLASS_ID>
     
     # 解析查询参数
-    query_params = {}
-    if '?' in url:
-        query_string = url.split('?', 1)[1]
-        query_params = dict(param.split('=') for param in query_string.split('&') if '=' in param)
+    query_params = parse_query_params(request.url)
     
     subject1 = query_params.get('subject1')
     subject2 = query_params.get('subject2')
@@ -921,37 +2474,22 @@ def on_request_analysis_correlation(env, request):
             'body': json.dumps({'error': 'Class not found'})
         }
     
-    # 获取班级中的所有学生
-    students = get_students_by_class(env, class_id)
-    if not students:
+    # 一次查询获取每个学生各科目的最新成绩
+    score_rows = get_class_score_rows(env, class_id)
+    if not score_rows:
         return {
             'status': 404,
             'headers': {'Content-Type': 'application/json'},
             'body': json.dumps({'error': 'No students found in class'})
         }
     
-    # 获取每个学生在两个科目上的成绩
+    # 只有当两个科目都有成绩时才记录
     student_scores = {}
-    for student in students:
-        student_id = student['id']
-        grades = get_grades_by_student(env, student_id)
-        
-        # 找到指定科目的成绩
-        subject1_score = None
-        subject2_score = None
-        
-        for grade in grades:
-            if grade['subject'] == subject1:
-                subject1_score = grade['score']
-            elif grade['subject'] == subject2:
-                subject2_score = grade['score']
-        
-        # 只有当两个科目都有成绩时才记录
-        if subject1_score is not None and subject2_score is not None:
+    for student_id, row in score_rows.items():
+        if subject1 in row and subject2 in row:
             student_scores[student_id] = {
-                'student_info': student,
-                'subject1_score': subject1_score,
-                'subject2_score': subject2_score
+                'subject1_score': row[subject1],
+                'subject2_score': row[subject2]
             }
     
     if not student_scores:
@@ -983,17 +2521,85 @@ def on_request_analysis_correlation(env, request):
         'body': json.dumps(correlation_result)
     }
 
+@require_auth
+@cache_analysis_response('class')
+def on_request_analysis_correlation_matrix(env, request, params):
+    """处理学科关联矩阵分析请求"""
+    user = env['user']
+    role = user['role']
+    
+    if role not in ['teacher', 'admin']:
+        return {
+            'status': 403,
+            'headers': {'Content-Type': 'application/json'},
+            'body': json.dumps({'error': 'Permission denied'})
+        }
+    
+    class_id = params['class_id']  # /api/analysis/correlation/matrix/<CLASS_ID>
+    
+    # 可选参数：exam 指定考试（默认取各科最新成绩），subjects 以逗号分隔限定科目
+    query_params = parse_query_params(request.url)
+    exam_name = query_params.get('exam')
+    
+    # 获取班级信息
+    class_info = get_class(env, class_id)
+    if not class_info:
+        return {
+            'status': 404,
+            'headers': {'Content-Type': 'application/json'},
+            'body': json.dumps({'error': 'Class not found'})
+        }
+    
+    # 一次查询加载班级的 学生×科目 分数矩阵
+    score_rows = get_class_score_rows(env, class_id, exam_name)
+    if not score_rows:
+        return {
+            'status': 404,
+            'headers': {'Content-Type': 'application/json'},
+            'body': json.dumps({'error': 'No grades found for class'})
+        }
+    
+    if query_params.get('subjects'):
+        # 去重并保留顺序：重复的科目会组成 (科目, 科目) 对并覆盖对角线
+        subjects = list(dict.fromkeys(
+            subject.strip() for subject in query_params['subjects'].split(',') if subject.strip()
+        ))
+    else:
+        subjects = sorted({subject for row in score_rows.values() for subject in row})
+    
+    correlation_result = {
+        'class_info': class_info,
+        'exam_name': exam_name,
+        'subjects': subjects,
+        'student_count': len(score_rows),
+        'matrix': calculate_correlation_matrix(list(score_rows.values()), subjects)
+    }
+    
+    return {
+        'status': 200,
+        'headers': {'Content-Type': 'application/json'},
+        'body': json.dumps(correlation_result)
+    }
+
 def calculate_correlation(x, y):
     """计算皮尔逊相关系数"""
     if len(x) != len(y) or len(x) < 2:
         return 0
     
-    n = len(x)
-    sum_x = sum(x)
-    sum_y = sum(y)
-    sum_xy = sum(xi * yi for xi, yi in zip(x, y))
-    sum_x2 = sum(xi ** 2 for xi in x)
-    sum_y2 = sum(yi ** 2 for yi in y)
+    sum_x = sum_y = sum_xy = sum_x2 = sum_y2 = 0
+    for xi, yi in zip(x, y):
+        sum_x += xi
+        sum_y += yi
+        sum_xy += xi * yi
+        sum_x2 += xi * xi
+        sum_y2 += yi * yi
+    
+    return correlation_from_sums(len(x), sum_x, sum_y, sum_xy, sum_x2, sum_y2)
+
+def correlation_from_sums(n, sum_x, sum_y, sum_xy, sum_x2, sum_y2):
+    """根据累加和计算皮尔逊相关系数"""
+    if n < 2:
+        return 0
     
     numerator = n * sum_xy - sum_x * sum_y
     denominator = ((n * sum_x2 - sum_x ** 2) * (n * sum_y2 - sum_y ** 2)) ** 0.5
@@ -1003,6 +2609,93 @@ def calculate_correlation(x, y):
     
     return numerator / denominator
 
+def rank_scores(scores):
+    """计算分数的秩（并列取平均秩）"""
+    order = sorted(range(len(scores)), key=lambda i: scores[i])
+    ranks = [0.0] * len(scores)
+    start = 0
+    while start < len(order):
+        end = start
+        while end + 1 < len(order) and scores[order[end + 1]] == scores[order[start]]:
+            end += 1
+        average_rank = (start + end) / 2 + 1
+        for position in range(start, end + 1):
+            ranks[order[position]] = average_rank
+        start = end + 1
+    return ranks
+
+def pairwise_correlation_sums(rows, subjects):
+    """一次遍历累加所有科目对的 (n, Σx, Σy, Σxy, Σx², Σy²)，只统计两科都有成绩的学生"""
+    sums = {}
+    for i, subject_a in enumerate(subjects):
+        for subject_b in subjects[i + 1:]:
+            sums[(subject_a, subject_b)] = [0, 0.0, 0.0, 0.0, 0.0, 0.0]
+    
+    for row in rows:
+        present = [subject for subject in subjects if subject in row]
+        for i, subject_a in enumerate(present):
+            x = row[subject_a]
+            for subject_b in present[i + 1:]:
+                y = row[subject_b]
+                acc = sums[(subject_a, subject_b)]
+                acc[0] += 1
+                acc[1] += x
+                acc[2] += y
+                acc[3] += x * y
+                acc[4] += x * x
+                acc[5] += y * y
+    return sums
+
+def calculate_correlation_matrix(rows, subjects):
+    """计算科目两两之间的皮尔逊和斯皮尔曼相关系数矩阵
+    
+    rows 为每个学生的 {科目: 分数} 字典，每对科目只统计两科都有成绩的学生。
+    斯皮尔曼系数先按科目求秩再复用同一累加过程；存在缺考的科目对单独按共同学生重新求秩。
+    subjects 中重复的科目只计算一次。
+    """
+    subjects = list(dict.fromkeys(subjects))
+    
+    # 按科目求秩，得到与rows对应的秩行
+    rank_rows = [{} for _ in rows]
+    for subject in subjects:
+        indexes = [i for i, row in enumerate(rows) if subject in row]
+        ranks = rank_scores([rows[i][subject] for i in indexes])
+        for i, rank in zip(indexes, ranks):
+            rank_rows[i][subject] = rank
+    
+    pearson_sums = pairwise_correlation_sums(rows, subjects)
+    spearman_sums = pairwise_correlation_sums(rank_rows, subjects)
+    
+    counts = {subject: sum(1 for row in rows if subject in row) for subject in subjects}
+    
+    matrix = {subject: {} for subject in subjects}
+    for subject in subjects:
+        matrix[subject][subject] = {
+            'pearson': 1.0,
+            'spearman': 1.0,
+            'student_count': counts[subject],
+            'interpretation': interpret_correlation(1.0)
+        }
+    for (subject_a, subject_b), acc in pearson_sums.items():
+        pearson = correlation_from_sums(*acc)
+        if acc[0] == counts[subject_a] == counts[subject_b]:
+            spearman = correlation_from_sums(*spearman_sums[(subject_a, subject_b)])
+        else:
+            common = [row for row in rows if subject_a in row and subject_b in row]
+            spearman = calculate_correlation(
+                rank_scores([row[subject_a] for row in common]),
+                rank_scores([row[subject_b] for row in common])
+            )
+        cell = {
+            'pearson': round(pearson, 4),
+            'spearman': round(spearman, 4),
+            'student_count': acc[0],
+            'interpretation': interpret_correlation(pearson)
+        }
+        matrix[subject_a][subject_b] = cell
+        matrix[subject_b][subject_a] = cell
+    return matrix
+
 def interpret_correlation(correlation):
     """解释相关系数"""
     abs_corr = abs(correlation)
@@ -1029,7 +2722,7 @@ def interpret_correlation(correlation):
 
 # AI智能分析功能
 @require_auth
-def on_request_analysis_class_summary(env, request):
+def on_request_analysis_class_summary(env, request, params):
     """处理班级AI总结报告请求"""
     user = env['user']
     role = user['role']
@@ -1041,33 +2734,23 @@ def on_request_analysis_class_summary(env, request):
             'body': json.dumps({'error': 'Permission denied'})
         }
     
-    # 解析URL参数获取班级ID
-    url = request.url
-    path_parts = url.split('/')
-    if len(path_parts) < 9:
+    class_id = params['class_id']  # /api/analysis/class/summary/<CLASS_ID>
+    
+    # 获取班级总体分析数据（直接调用分析函数，不再经过HTTP处理函数和JSON往返）
+    try:
+        analysis_data = compute_class_analysis(env, class_id)
+    except AnalysisNotFoundError as e:
         return {
-            'status': 400,
+            'status': 404,
             'headers': {'Content-Type': 'application/json'},
-            'body': json.dumps({'error': 'Missing class ID in URL'})
+            'body': json.dumps({'error': str(e)})
         }
     
-    class_id = path_parts[8]  # /api/analysis/class/summary/<CLASS_ID>
-    
-    # 获取班级总体分析数据
-    analysis_response = on_request_analysis_class(env, request)
-    
-    # 如果分析失败，直接返回错误
-    if analysis_response['status'] != 200:
-        return analysis_response
-    
-    # 解析分析结果
-    analysis_data = json.loads(analysis_response['body'])
-    
     # 构造AI提示词
     prompt = construct_class_summary_prompt(analysis_data)
     
-    # 调用AI服务生成总结报告
-    ai_summary = generate_ai_summary(env, prompt)
+    # 调用AI服务生成总结报告（相同分析数据直接返回已保存的报告）
+    ai_summary = generate_ai_summary(env, prompt, f"class:{class_id}")
     
     return {
         'status': 200,
@@ -1104,22 +2787,12 @@ def construct_class_summary_prompt(analysis_data):
     return prompt
 
 @require_auth
-def on_request_analysis_student_advice(env, request):
+def on_request_analysis_student_advice(env, request, params):
     """处理学生个性化建议请求"""
     user = env['user']
     role = user['role']
     
-    # 解析URL参数获取学生ID
-    url = request.url
-    path_parts = url.split('/')
-    if len(path_parts) < 9:
-        return {
-            'status': 400,
-            'headers': {'Content-Type': 'application/json'},
-            'body': json.dumps({'error': 'Missing student ID in URL'})
-        }
-    
-    student_id = path_parts[8]  # /api/analysis/student/advice/<STUDENT_ID>
+    student_id = params['student_id']  # /api/analysis/student/advice/<STUDENT_ID>
     
     # 检查权限：学生只能查看自己的数据，教师和管理员可以查看所有数据
     if role == 'student' and user['user_id'] != student_id:
@@ -1129,21 +2802,21 @@ def on_request_analysis_student_advice(env, request):
             'body': json.dumps({'error': 'Permission denied'})
         }
     
-    # 获取学生纵向趋势分析数据
-    trend_response = on_request_analysis_student_longitudinal(env, request)
-    
-    # 如果分析失败，直接返回错误
-    if trend_response['status'] != 200:
-        return trend_response
-    
-    # 解析分析结果
-    trend_data = json.loads(trend_response['body'])
+    # 获取学生纵向趋势分析数据（直接调用分析函数，不再经过HTTP处理函数和JSON往返）
+    try:
+        trend_data = compute_student_trend(env, student_id)
+    except AnalysisNotFoundError as e:
+        return {
+            'status': 404,
+            'headers': {'Content-Type': 'application/json'},
+            'body': json.dumps({'error': str(e)})
+        }
     
     # 构造AI提示词
     prompt = construct_student_advice_prompt(trend_data)
     
-    # 调用AI服务生成个性化建议
-    ai_advice = generate_ai_summary(env, prompt)
+    # 调用AI服务生成个性化建议（相同分析数据直接返回已保存的建议）
+    ai_advice = generate_ai_summary(env, prompt, f"student:{student_id}")
     
     return {
         'status': 200,
@@ -1162,7 +2835,7 @@ def construct_student_advice_prompt(trend_data):
     prompt = f"请根据以下小学{student_info['name']}同学的成绩趋势分析，生成一份个性化的学习建议：\n\n"
     prompt += f"学生基本信息：\n"
     prompt += f"- 姓名：{student_info['name']}\n"
-    prompt += f"- 学号：{student_info['student_id']}\n\n"
+    prompt += f"- 学号：{student_info['student_number']}\n\n"
     
     prompt += f"各科目成绩趋势：\n"
     for subject, trend in subject_trends.items():
@@ -1178,86 +2851,697 @@ def construct_student_advice_prompt(trend_data):
     
     return prompt
 
-def generate_ai_summary(env, prompt):
-    """调用AI服务生成总结报告"""
+# AI总结缓存有效期（秒）；提示词包含全部分析数据，数据变化后自然生成新的缓存键
+AI_SUMMARY_TTL = 7 * 24 * 3600
+
+def call_ai_service(env, prompt):
+    """调用AI服务，失败时抛出异常"""
+    # 调用AI服务（简化实现，实际应用中需要根据Cloudflare Workers AI的具体API调整）
+    ai = env['AI']
+    # 这里应该调用AI的聊天完成接口，但为了简化，我们返回模拟的AI响应
+    return f"AI分析结果（模拟）：\n\n{prompt[:100]}...\n\n[此处应为AI生成的详细分析报告]"
+
+def generate_ai_summary(env, prompt, scope):
+    """调用AI服务生成总结报告，失败时返回提示信息"""
     # 检查是否有AI绑定
     if 'AI' not in env:
         return "AI服务未配置，请联系管理员。"
     
     try:
-        # 调用AI服务（简化实现，实际应用中需要根据Cloudflare Workers AI的具体API调整）
-        ai = env['AI']
-        # 这里应该调用AI的聊天完成接口，但为了简化，我们返回模拟的AI响应
-        return f"AI分析结果（模拟）：\n\n{prompt[:100]}...\n\n[此处应为AI生成的详细分析报告]"
+        return get_or_create_ai_summary(env, prompt, scope)
     except Exception as e:
         return f"AI分析失败：{str(e)}"
 
-# 主处理函数
-def handle_request(env, request):
-    """主请求处理函数"""
-    # 路由处理
-    url = request.url
-    path = url.split('?', 1)[0]  # 移除查询参数
+def hash_ai_prompt(prompt):
+    """计算提示词哈希（AI总结缓存键）"""
+    return hashlib.sha256(prompt.encode('utf-8')).hexdigest()
+
+def get_cached_ai_summaries(env, prompt_hashes):
+    """批量读取有效期内的AI总结，返回 {提示词哈希: 总结}"""
+    db = env['DB']
+    now = int(time.time())
+    summaries = {}
+    for chunk in chunked(list(prompt_hashes), D1_MAX_BOUND_PARAMS - 1):
+        placeholders = ', '.join(['?'] * len(chunk))
+        query = f"""
+            SELECT prompt_hash, summary FROM ai_summaries
+            WHERE prompt_hash IN ({placeholders}) AND expires_at > ?
+        """
+        for row in db.prepare(query).bind(*chunk, now).all():
+            summaries[row['prompt_hash']] = row['summary']
+    return summaries
+
+def save_ai_summary(env, prompt_hash, scope, summary):
+    """保存AI总结，顺带清理已过期的记录"""
+    db = env['DB']
+    now = int(time.time())
+    db.batch([
+        db.prepare("DELETE FROM ai_summaries WHERE expires_at <= ?").bind(now),
+        db.prepare("""
+            INSERT INTO ai_summaries (prompt_hash, scope, summary, created_at, expires_at)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(prompt_hash) DO UPDATE SET
+                scope = excluded.scope,
+                summary = excluded.summary,
+                created_at = excluded.created_at,
+                expires_at = excluded.expires_at
+        """).bind(prompt_hash, scope, summary, now, now + AI_SUMMARY_TTL),
+    ])
+
+def get_or_create_ai_summary(env, prompt, scope):
+    """有效期内相同提示词直接返回已保存的总结，否则调用AI服务生成并保存
     
-    # API路由
-    if path.endswith('/api/login'):
-        return on_request_login(env, request)
-    elif path.endswith('/api/logout'):
-        return on_request_logout(env, request)
-    elif path.startswith('/api/grades'):
-        return on_request_grades(env, request)
-    elif path.startswith('/api/template/grades.xlsx'):
-        return on_request_template(env, request)
-    elif path.startswith('/api/import/grades'):
-        return on_request_import_grades(env, request)
-    elif path.startswith('/api/analysis/class/'):
-        if 'summary' in path:
-            return on_request_analysis_class_summary(env, request)
+    scope 标识报告所属对象（如 class:<id>、student:<id>），用于按对象清除缓存；
+    AI调用失败时抛出异常，失败结果不写入缓存
+    """
+    prompt_hash = hash_ai_prompt(prompt)
+    cached = get_cached_ai_summaries(env, [prompt_hash])
+    if prompt_hash in cached:
+        return cached[prompt_hash]
+    
+    summary = call_ai_service(env, prompt)
+    save_ai_summary(env, prompt_hash, scope, summary)
+    return summary
+
+def invalidate_ai_summaries(env, scope=None):
+    """清除AI总结缓存，未指定scope时清除全部，返回清除的条数"""
+    db = env['DB']
+    if scope is None:
+        result = db.prepare("DELETE FROM ai_summaries RETURNING prompt_hash").all()
+    else:
+        result = db.prepare("DELETE FROM ai_summaries WHERE scope = ? RETURNING prompt_hash").bind(scope).all()
+    return len(result)
+
+def iter_grade_level_summaries(env, grade_level):
+    """逐个产出年级各班级的AI总结（NDJSON行），缓存命中的先产出，其余逐个调用AI服务"""
+    analyses = compute_grade_level_class_analyses(env, grade_level)
+    prompts = {
+        analysis['class_info']['id']: construct_class_summary_prompt(analysis)
+        for analysis in analyses
+    }
+    cached = get_cached_ai_summaries(env, [hash_ai_prompt(prompt) for prompt in prompts.values()])
+    
+    pending = []
+    for analysis in analyses:
+        class_id = analysis['class_info']['id']
+        summary = cached.get(hash_ai_prompt(prompts[class_id]))
+        if summary is None:
+            pending.append(analysis)
+            continue
+        yield json.dumps({'class_analysis': analysis, 'ai_summary': summary}) + '\n'
+    
+    # Workers的Pyodide运行时不支持线程，未命中缓存的班级逐个调用，每完成一个即输出一行
+    failed = 0
+    for analysis in pending:
+        class_id = analysis['class_info']['id']
+        try:
+            summary = call_ai_service(env, prompts[class_id])
+        except Exception as e:
+            failed += 1
+            yield json.dumps({'class_analysis': analysis, 'error': f"AI分析失败：{str(e)}"}) + '\n'
+            continue
+        save_ai_summary(env, hash_ai_prompt(prompts[class_id]), f"class:{class_id}", summary)
+        yield json.dumps({'class_analysis': analysis, 'ai_summary': summary}) + '\n'
+    
+    yield json.dumps({'done': True, 'class_count': len(analyses), 'failed': failed}) + '\n'
+
+@require_auth
+def on_request_analysis_grade_level_summary(env, request, params):
+    """处理年级所有班级AI总结报告请求（NDJSON流式返回，每个班级完成即输出一行）"""
+    user = env['user']
+    
+    if user['role'] != 'admin':
+        return {
+            'status': 403,
+            'headers': {'Content-Type': 'application/json'},
+            'body': json.dumps({'error': 'Permission denied'})
+        }
+    
+    if 'AI' not in env:
+        return {
+            'status': 503,
+            'headers': {'Content-Type': 'application/json'},
+            'body': json.dumps({'error': 'AI服务未配置，请联系管理员。'})
+        }
+    
+    grade_level = params['grade_level']  # /api/analysis/grade/summary/<GRADE_LEVEL>
+    
+    return {
+        'status': 200,
+        'headers': {'Content-Type': 'application/x-ndjson'},
+        'body': iter_grade_level_summaries(env, grade_level)
+    }
+
+# AI报告异步任务：POST创建任务并投递到队列，队列消费者生成报告，客户端轮询任务状态
+AI_JOB_KINDS = ('class_summary', 'student_advice')
+
+class LocalJobQueue:
+    """未绑定 AI_QUEUE 时使用的进程内队列，轮询任务状态时消费该任务的消息"""
+    
+    def __init__(self):
+        self.messages = []
+    
+    def send(self, body):
+        self.messages.append(body)
+    
+    def drain(self, env, job_id):
+        """消费指定任务的待处理消息，其他任务的消息留待各自的轮询处理"""
+        messages = [body for body in self.messages if json.loads(body)['job_id'] == job_id]
+        self.messages = [body for body in self.messages if json.loads(body)['job_id'] != job_id]
+        handle_queue_batch(env, [LocalQueueMessage(self, body) for body in messages])
+
+class LocalQueueMessage:
+    """与 Queues 消息接口一致的本地消息"""
+    
+    def __init__(self, queue, body):
+        self.queue = queue
+        self.body = body
+    
+    def ack(self):
+        pass
+    
+    def retry(self):
+        self.queue.send(self.body)
+
+local_job_queue = LocalJobQueue()
+
+def get_job_queue(env):
+    """获取任务队列（优先使用 Cloudflare Queues 绑定）"""
+    return env['AI_QUEUE'] if 'AI_QUEUE' in env else local_job_queue
+
+def create_ai_job(env, kind, target_id, user_id):
+    """创建AI报告任务并投递到队列"""
+    db = env['DB']
+    job_id = str(uuid.uuid4())
+    now = int(time.time())
+    db.prepare("""
+        INSERT INTO ai_jobs (id, kind, target_id, status, created_by, created_at, updated_at)
+        VALUES (?, ?, ?, 'pending', ?, ?, ?)
+    """).bind(job_id, kind, target_id, user_id, now, now).run()
+    get_job_queue(env).send(json.dumps({'job_id': job_id}))
+    return get_ai_job(env, job_id)
+
+def get_ai_job(env, job_id):
+    """获取AI报告任务"""
+    db = env['DB']
+    job = db.prepare("SELECT * FROM ai_jobs WHERE id = ?").bind(job_id).first()
+    if job and job['result'] is not None:
+        job['result'] = json.loads(job['result'])
+    return job
+
+def run_ai_job(env, kind, target_id):
+    """执行AI报告任务，返回任务结果"""
+    if 'AI' not in env:
+        raise RuntimeError('AI服务未配置')
+    
+    if kind == 'class_summary':
+        analysis_data = compute_class_analysis(env, target_id)
+        prompt = construct_class_summary_prompt(analysis_data)
+        return {
+            'class_analysis': analysis_data,
+            'ai_summary': get_or_create_ai_summary(env, prompt, f"class:{target_id}")
+        }
+    
+    trend_data = compute_student_trend(env, target_id)
+    prompt = construct_student_advice_prompt(trend_data)
+    return {
+        'student_analysis': trend_data,
+        'ai_advice': get_or_create_ai_summary(env, prompt, f"student:{target_id}")
+    }
+
+AI_JOB_LEASE_SECONDS = 10 * 60  # running 状态超过此时长未更新，视为执行者已中断，任务可被重新领取
+
+def release_ai_job(env, job_id):
+    """把已领取但未能写入结果的任务放回 pending（失败时由租约超时兜底）"""
+    db = env['DB']
+    try:
+        db.prepare("""
+            UPDATE ai_jobs SET status = 'pending', updated_at = ? WHERE id = ? AND status = 'running'
+        """).bind(int(time.time()), job_id).run()
+    except Exception:
+        pass
+
+def process_ai_job(env, job_id):
+    """处理单个AI报告任务，返回消息是否可以确认
+    
+    领取待执行的任务或租约已过期的执行中任务；已完成、已失败的任务直接确认，
+    仍在其他执行者租约内的任务返回 False 以便稍后重试消息
+    """
+    db = env['DB']
+    now = int(time.time())
+    job = db.prepare("""
+        UPDATE ai_jobs SET status = 'running', updated_at = ?
+        WHERE id = ? AND (status = 'pending' OR (status = 'running' AND updated_at < ?))
+        RETURNING kind, target_id
+    """).bind(now, job_id, now - AI_JOB_LEASE_SECONDS).first()
+    if not job:
+        current = db.prepare("SELECT status FROM ai_jobs WHERE id = ?").bind(job_id).first()
+        return not (current and current['status'] == 'running')
+    
+    try:
+        try:
+            result = run_ai_job(env, job['kind'], job['target_id'])
+        except Exception as e:
+            db.prepare("""
+                UPDATE ai_jobs SET status = 'failed', error = ?, updated_at = ? WHERE id = ?
+            """).bind(str(e), int(time.time()), job_id).run()
+        else:
+            db.prepare("""
+                UPDATE ai_jobs SET status = 'done', result = ?, updated_at = ? WHERE id = ?
+            """).bind(json.dumps(result), int(time.time()), job_id).run()
+    except Exception:
+        # 结果写入失败：放回 pending，重试的消息可以立即重新领取
+        release_ai_job(env, job_id)
+        raise
+    return True
+
+def handle_queue_batch(env, messages):
+    """队列消费者：逐条处理任务消息，数据库异常或任务仍被占用时重试"""
+    for message in messages:
+        try:
+            finished = process_ai_job(env, json.loads(message.body)['job_id'])
+        except Exception:
+            finished = False
+        if finished:
+            message.ack()
+        else:
+            message.retry()
+
+@require_auth
+def on_request_ai_jobs(env, request, params):
+    """处理AI报告任务请求（POST创建任务，GET查询任务状态）"""
+    user = env['user']
+    role = user['role']
+    
+    if request.method == 'POST':
+        # 解析请求体
+        body = request.body.read().decode('utf-8')
+        try:
+            data = json.loads(body) if body else {}
+        except ValueError:
+            data = None
+        if not isinstance(data, dict):
+            return {
+                'status': 400,
+                'headers': {'Content-Type': 'application/json'},
+                'body': json.dumps({'error': 'Request body must be a JSON object'})
+            }
+        
+        kind = data.get('kind')
+        target_id = data.get('target_id')
+        if kind not in AI_JOB_KINDS or not target_id:
+            return {
+                'status': 400,
+                'headers': {'Content-Type': 'application/json'},
+                'body': json.dumps({'error': 'Missing or invalid fields: kind, target_id'})
+            }
+        
+        # 权限与同步接口一致：班级报告限教师和管理员，学生只能生成自己的建议
+        if (kind == 'class_summary' and role not in ['teacher', 'admin']) or \
+                (kind == 'student_advice' and role == 'student' and user['user_id'] != target_id):
+            return {
+                'status': 403,
+                'headers': {'Content-Type': 'application/json'},
+                'body': json.dumps({'error': 'Permission denied'})
+            }
+        
+        job = create_ai_job(env, kind, target_id, user['user_id'])
+        
+        return {
+            'status': 202,
+            'headers': {
+                'Content-Type': 'application/json',
+                'Location': f"/api/analysis/jobs/{job['id']}"
+            },
+            'body': json.dumps({'success': True, 'job': job})
+        }
+    
+    elif request.method == 'GET':
+        job_id = params.get('job_id')
+        if not job_id:
+            return {
+                'status': 400,
+                'headers': {'Content-Type': 'application/json'},
+                'body': json.dumps({'error': 'Missing job ID in URL'})
+            }
+        
+        job = get_ai_job(env, job_id)
+        if not job:
+            return {
+                'status': 404,
+                'headers': {'Content-Type': 'application/json'},
+                'body': json.dumps({'error': 'Job not found'})
+            }
+        
+        if role != 'admin' and job['created_by'] != user['user_id']:
+            return {
+                'status': 403,
+                'headers': {'Content-Type': 'application/json'},
+                'body': json.dumps({'error': 'Permission denied'})
+            }
+        
+        # 本地队列没有独立的消费者，确认权限后只处理本次查询的任务
+        if 'AI_QUEUE' not in env and job['status'] in ('pending', 'running'):
+            local_job_queue.drain(env, job_id)
+            job = get_ai_job(env, job_id)
+        
+        return {
+            'status': 200,
+            'headers': {'Content-Type': 'application/json'},
+            'body': json.dumps({'job': job})
+        }
+    
+    else:
+        return {
+            'status': 405,
+            'headers': {'Content-Type': 'application/json'},
+            'body': json.dumps({'error': 'Method not allowed'})
+        }
+
+# 管理功能
+@require_auth
+def on_request_rebuild_stats(env, request, params):
+    """处理重建成绩汇总表请求"""
+    user = env['user']
+    
+    if user['role'] != 'admin':
+        return {
+            'status': 403,
+            'headers': {'Content-Type': 'application/json'},
+            'body': json.dumps({'error': 'Permission denied'})
+        }
+    
+    if request.method != 'POST':
+        return {
+            'status': 405,
+            'headers': {'Content-Type': 'application/json'},
+            'body': json.dumps({'error': 'Method not allowed'})
+        }
+    
+    group_count = rebuild_stats(env)
+    
+    return {
+        'status': 200,
+        'headers': {'Content-Type': 'application/json'},
+        'body': json.dumps({'success': True, 'group_count': group_count})
+    }
+
+@require_auth
+def on_request_invalidate_ai_summaries(env, request, params):
+    """处理清除AI总结缓存请求（可按 class_id 或 student_id 指定范围）"""
+    user = env['user']
+    
+    if user['role'] != 'admin':
+        return {
+            'status': 403,
+            'headers': {'Content-Type': 'application/json'},
+            'body': json.dumps({'error': 'Permission denied'})
+        }
+    
+    if request.method != 'DELETE':
+        return {
+            'status': 405,
+            'headers': {'Content-Type': 'application/json'},
+            'body': json.dumps({'error': 'Method not allowed'})
+        }
+    
+    query_params = parse_query_params(request.url)
+    if 'class_id' in query_params:
+        scope = f"class:{query_params['class_id']}"
+    elif 'student_id' in query_params:
+        scope = f"student:{query_params['student_id']}"
+    else:
+        scope = None
+    
+    deleted = invalidate_ai_summaries(env, scope)
+    
+    return {
+        'status': 200,
+        'headers': {'Content-Type': 'application/json'},
+        'body': json.dumps({'success': True, 'deleted': deleted})
+    }
+
+# 路由
+ROUTE_CONVERTERS = {'str': str, 'int': int}
+
+class RouteNode:
+    """路由前缀树节点"""
+    __slots__ = ('children', 'param', 'handler')
+    
+    def __init__(self):
+        self.children = {}
+        self.param = None  # (参数名, 类型转换函数, 子节点)
+        self.handler = None
+
+def split_path(path):
+    """将路径拆分为URL解码后的非空路径段"""
+    return [unquote(segment) if '%' in segment else segment for segment in path.split('/') if segment]
+
+class Router:
+    """按路径段构建的前缀树路由，匹配耗时只与路径段数有关
+    
+    路由模式中的 <name> 或 <int:name> 为路径参数，静态路径段优先于参数匹配
+    """
+    
+    def __init__(self):
+        self.root = RouteNode()
+    
+    def add(self, pattern, handler):
+        """注册路由"""
+        node = self.root
+        for segment in split_path(pattern):
+            if segment.startswith('<') and segment.endswith('>'):
+                converter_name, _, name = segment[1:-1].rpartition(':')
+                converter = ROUTE_CONVERTERS[converter_name or 'str']
+                if node.param is None:
+                    node.param = (name, converter, RouteNode())
+                elif node.param[0] != name or node.param[1] is not converter:
+                    raise ValueError(f'Conflicting path parameter in route: {pattern}')
+                node = node.param[2]
+            else:
+                node = node.children.setdefault(segment, RouteNode())
+        node.handler = handler
+    
+    def match(self, path):
+        """匹配路径，返回 (处理函数, 路径参数)；未匹配时处理函数为None"""
+        segments = split_path(path)
+        
+        # 快速路径：逐段前进，静态段优先，不回溯
+        params = {}
+        node = self.root
+        for segment in segments:
+            child = node.children.get(segment)
+            if child is None:
+                if node.param is None:
+                    break
+                name, converter, child = node.param
+                try:
+                    params[name] = converter(segment)
+                except ValueError:
+                    break
+            node = child
         else:
-            return on_request_analysis_class(env, request)
-    elif path.startswith('/api/analysis/student/longitudinal/'):
-        return on_request_analysis_student_longitudinal(env, request)
-    elif path.startswith('/api/analysis/student/advice/'):
-        return on_request_analysis_student_advice(env, request)
-    elif path.startswith('/api/analysis/comparison/'):
-        return on_request_analysis_comparison(env, request)
-    elif path.startswith('/api/analysis/correlation/'):
-        return on_request_analysis_correlation(env, request)
+            if node.handler is not None:
+                return node.handler, params
+        
+        # 静态段走不通时回溯尝试参数分支
+        params = {}
+        handler = self._match(self.root, segments, 0, params)
+        return handler, params
+    
+    def _match(self, node, segments, index, params):
+        if index == len(segments):
+            return node.handler
+        segment = segments[index]
+        
+        child = node.children.get(segment)
+        if child is not None:
+            handler = self._match(child, segments, index + 1, params)
+            if handler is not None:
+                return handler
+        
+        if node.param is not None:
+            name, converter, child = node.param
+            try:
+                value = converter(segment)
+            except ValueError:
+                return None
+            handler = self._match(child, segments, index + 1, params)
+            if handler is not None:
+                params[name] = value
+                return handler
+        return None
+
+def static_handler(file_path, content_type):
+    """生成静态文件路由的处理函数"""
+    def handler(env, request, params):
+        return serve_static_file(request, file_path, content_type)
+    return handler
+
+def build_router():
+    """构建路由表"""
+    router = Router()
+    
+    # API路由
+    router.add('/api/login', on_request_login)
+    router.add('/api/logout', on_request_logout)
+    router.add('/api/grades', on_request_grades)
+    router.add('/api/grades/<grade_id>', on_request_grades)
+    router.add('/api/template/grades.xlsx', on_request_template)
+    router.add('/api/import/grades', on_request_import_grades)
+    router.add('/api/export/grades', on_request_export_grades)
+    router.add('/api/export/grades.xlsx', on_request_export_grades)
+    router.add('/api/export/grades.csv', on_request_export_grades)
+    router.add('/api/export/grades.ndjson', on_request_export_grades)
+    router.add('/api/analysis/class/<class_id>', on_request_analysis_class)
+    router.add('/api/analysis/class/summary/<class_id>', on_request_analysis_class_summary)
+    router.add('/api/analysis/student/longitudinal/<student_id>', on_request_analysis_student_longitudinal)
+    router.add('/api/analysis/student/advice/<student_id>', on_request_analysis_student_advice)
+    router.add('/api/analysis/comparison/<class_id>', on_request_analysis_comparison)
+    router.add('/api/analysis/correlation/<class_id>', on_request_analysis_correlation)
+    router.add('/api/analysis/correlation/matrix/<class_id>', on_request_analysis_correlation_matrix)
+    router.add('/api/analysis/grade/summary/<int:grade_level>', on_request_analysis_grade_level_summary)
+    router.add('/api/analysis/jobs', on_request_ai_jobs)
+    router.add('/api/analysis/jobs/<job_id>', on_request_ai_jobs)
+    router.add('/api/admin/stats/rebuild', on_request_rebuild_stats)
+    router.add('/api/admin/ai-summaries', on_request_invalidate_ai_summaries)
     
     # 静态文件路由
-    elif path == '/' or path == '/index.html':
-        return serve_static_file('dist/index.html', 'text/html')
-    elif path == '/styles.css':
-        return serve_static_file('dist/styles.css', 'text/css')
-    elif path == '/app.js':
-        return serve_static_file('dist/app.js', 'application/javascript')
+    router.add('/', static_handler('dist/index.html', 'text/html'))
+    router.add('/index.html', static_handler('dist/index.html', 'text/html'))
+    router.add('/styles.css', static_handler('dist/styles.css', 'text/css'))
+    router.add('/app.js', static_handler('dist/app.js', 'application/javascript'))
+    
+    return router
+
+# 主处理函数
+def handle_request(env, request):
+    """主请求处理函数"""
+    # 路由处理（只取路径部分，忽略协议、域名和查询参数）
+    path = urlsplit(request.url).path
+    handler, params = ROUTER.match(path)
     
     # 404 Not Found
-    else:
+    if handler is None:
         return {
             'status': 404,
             'headers': {'Content-Type': 'application/json'},
             'body': json.dumps({'error': 'Not found'})
         }
-
-def serve_static_file(file_path, content_type):
-    """提供静态文件服务"""
+    
+    # 处理期间使用带统计的数据库访问层（流式响应体在返回后读取的数据不计入）
+    raw_db = env['DB']
+    db = env['DB'] = InstrumentedDB(raw_db)
     try:
-        with open(file_path, 'r', encoding='utf-8') as f:
+        response = handler(env, request, params)
+    finally:
+        env['DB'] = raw_db
+    
+    stats = db.stats
+    response['headers'] = dict(response['headers'], **{'Server-Timing': stats.server_timing()})
+    if 'DEBUG_QUERIES' in env:
+        print(f"[db] {request.method} {path} status={response['status']} queries={stats.queries} "
+              f"round_trips={stats.round_trips} rows={stats.rows} time={stats.duration * 1000:.1f}ms")
+    return response
+
+# 静态文件缓存：每个isolate只读取一次，预先计算ETag
+STATIC_CACHE_CONTROL = 'public, max-age=31536000, immutable'  # 版本号与当前内容一致的资源
+STATIC_REVALIDATE_CACHE_CONTROL = 'no-cache'  # 页面及未带（或带过期）版本号的资源，每次通过ETag协商
+STATIC_VERSION_LENGTH = 12  # 版本号取内容哈希的前12位
+STATIC_FINGERPRINTED_ASSETS = {
+    'app.js': ('dist/app.js', 'application/javascript'),
+    'styles.css': ('dist/styles.css', 'text/css'),
+}
+static_assets = {}
+
+def fingerprint_html(content):
+    """为页面中引用的静态资源加上内容哈希版本号，使其可以长期缓存"""
+    html = content.decode('utf-8')
+    for name, (file_path, content_type) in STATIC_FINGERPRINTED_ASSETS.items():
+        asset = load_static_asset(file_path, content_type)
+        html = html.replace(f'="{name}"', f'="{name}?v={asset["version"]}"')
+    return html.encode('utf-8')
+
+def load_static_asset(file_path, content_type):
+    """加载静态文件及其ETag"""
+    asset = static_assets.get(file_path)
+    if asset is None:
+        with open(file_path, 'rb') as f:
             content = f.read()
-        return {
-            'status': 200,
-            'headers': {'Content-Type': content_type},
-            'body': content
+        if content_type == 'text/html':
+            content = fingerprint_html(content)
+        content_hash = hashlib.sha256(content).hexdigest()
+        asset = {
+            'content_type': f'{content_type}; charset=utf-8',
+            'hash': content_hash,
+            'version': content_hash[:STATIC_VERSION_LENGTH],
+            'etag': f'"{content_hash[:32]}"',
+            'content': content,
         }
+        static_assets[file_path] = asset
+    return asset
+
+def etag_matches(if_none_match, etag):
+    """判断If-None-Match是否命中（弱比较）"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    for candidate in if_none_match.split(','):
+        candidate = candidate.strip()
+        if candidate.startswith('W/'):
+            candidate = candidate[2:]
+        if candidate == etag:
+            return True
+    return False
+
+def serve_static_file(request, file_path, content_type):
+    """提供静态文件服务"""
+    try:
+        asset = load_static_asset(file_path, content_type)
     except Exception as e:
         return {
             'status': 500,
             'headers': {'Content-Type': 'application/json'},
             'body': json.dumps({'error': f'Failed to read file: {str(e)}'})
         }
+    
+    # 只有版本号与当前内容一致时才允许长期缓存，否则旧页面引用的旧版本号会把新内容缓存一年
+    version = parse_qs(urlsplit(request.url).query).get('v', [None])[0]
+    immutable = content_type != 'text/html' and version == asset['version']
+    
+    # 响应体不做预压缩：Workers运行时会按Accept-Encoding自动压缩，预压缩的响应体会被再次编码
+    headers = {
+        'Content-Type': asset['content_type'],
+        'Cache-Control': STATIC_CACHE_CONTROL if immutable else STATIC_REVALIDATE_CACHE_CONTROL,
+        'ETag': asset['etag']
+    }
+    
+    if etag_matches(request.headers.get('If-None-Match'), asset['etag']):
+        return {
+            'status': 304,
+            'headers': headers,
+            'body': b''
+        }
+    
+    return {
+        'status': 200,
+        'headers': headers,
+        'body': asset['content']
+    }
+
+ROUTER = build_router()
 
 # Python Workers入口点
 async def main(request, env):
     """Python Workers入口点"""
-    return handle_request(env, request)
\ No newline at end of file
+    return handle_request(env, request)
+
+async def queue(batch, env):
+    """Queues消费者入口点"""
+    raw_db = env['DB']
+    env['DB'] = InstrumentedDB(raw_db)
+    try:
+        handle_queue_batch(env, batch.messages)
+    finally:
+        env['DB'] = raw_db
\ No newline at end of file
@@ -0,0 +1,93 @@
+import io
+import os
+import sqlite3
+import sys
+
+import pytest
+
+# worker.py 和 init_db.py 位于 src/，以脚本方式互相导入
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+import init_db
+import worker
+
+
+class FakeStatement:
+    """与D1预编译语句接口一致的SQLite语句"""
+
+    def __init__(self, db, sql, params=()):
+        self.db = db
+        self.sql = sql
+        self.params = params
+
+    def bind(self, *params):
+        return FakeStatement(self.db, self.sql, params)
+
+    def execute(self):
+        return [dict(row) for row in self.db.conn.execute(self.sql, self.params)]
+
+    def all(self):
+        self.db.round_trips += 1
+        return self.execute()
+
+    def first(self):
+        rows = self.all()
+        return rows[0] if rows else None
+
+    def run(self):
+        self.all()
+
+
+class FakeD1:
+    """基于内存SQLite的D1替身，统计与数据库的往返次数（每次 all/first/run/batch 计一次）"""
+
+    def __init__(self):
+        self.conn = sqlite3.connect(':memory:', isolation_level=None)
+        self.conn.row_factory = sqlite3.Row
+        self.round_trips = 0
+
+    def prepare(self, sql):
+        return FakeStatement(self, sql)
+
+    def batch(self, statements):
+        # 与D1一致：整个batch在单个事务中执行，失败时整体回滚
+        self.round_trips += 1
+        self.conn.execute('BEGIN')
+        try:
+            results = [statement.execute() for statement in statements]
+        except Exception:
+            self.conn.execute('ROLLBACK')
+            raise
+        self.conn.execute('COMMIT')
+        return results
+
+
+class FakeRequest:
+    """与Workers请求对象接口一致的最小请求"""
+
+    def __init__(self, method, url, body=b'', headers=None):
+        self.method = method
+        self.url = url
+        self.body = io.BytesIO(body)
+        self.headers = dict(headers or {})
+
+
+@pytest.fixture
+def env():
+    """已执行全部迁移并写入测试数据的 worker 运行环境"""
+    db = FakeD1()
+    init_db.apply_migrations(db.conn)
+    init_db.insert_test_data(db.conn.cursor())
+    db.conn.executescript(init_db.REBUILD_STATS_SQL)
+    db.round_trips = 0
+    return {'DB': db}
+
+
+@pytest.fixture
+def call(env):
+    """以指定身份调用 worker.handle_request，返回响应字典"""
+    def call(method, path, body=b'', headers=None, role='teacher', class_id='class_1', user_id='teacher'):
+        headers = dict(headers or {})
+        headers['Authorization'] = 'Bearer ' + worker.generate_token(user_id, role, class_id)
+        return worker.handle_request(env, FakeRequest(method, 'https://example.com' + path, body, headers))
+    return call
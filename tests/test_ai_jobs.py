@@ -0,0 +1,39 @@
+import json
+
+import pytest
+
+import worker
+
+
+@pytest.fixture
+def queue(env, monkeypatch):
+    env['AI'] = object()
+    queue = worker.LocalJobQueue()
+    monkeypatch.setattr(worker, 'local_job_queue', queue)
+    return queue
+
+
+def create_job(call, user_id):
+    body = json.dumps({'kind': 'class_summary', 'target_id': 'class_1'}).encode('utf-8')
+    response = call('POST', '/api/analysis/jobs', body, user_id=user_id)
+    assert response['status'] == 202
+    return json.loads(response['body'])['job']['id']
+
+
+def test_poll_runs_only_the_callers_job_after_permission_check(call, queue):
+    mine = create_job(call, 'teacher_a')
+    theirs = create_job(call, 'teacher_b')
+
+    assert call('GET', f'/api/analysis/jobs/{theirs}', user_id='teacher_a')['status'] == 403
+    assert len(queue.messages) == 2
+
+    response = call('GET', f'/api/analysis/jobs/{mine}', user_id='teacher_a')
+    assert response['status'] == 200
+    assert json.loads(response['body'])['job']['status'] == 'done'
+    assert [json.loads(body)['job_id'] for body in queue.messages] == [theirs]
+
+
+@pytest.mark.parametrize('body', [b'[1]', b'"class_summary"', b'null', b'{bad'])
+def test_create_job_rejects_non_object_body(call, queue, body):
+    assert call('POST', '/api/analysis/jobs', body)['status'] == 400
+    assert queue.messages == []
@@ -0,0 +1,39 @@
+import json
+
+import worker
+
+
+def summary_lines(env, grade_level):
+    return [json.loads(line) for line in worker.iter_grade_level_summaries(env, grade_level)]
+
+
+def test_grade_level_summaries_report_failures_per_class(env, monkeypatch):
+    env['AI'] = object()
+    env['DB'].conn.executescript("""
+        INSERT INTO students (id, name, student_number, class_id) VALUES ('student_9', '赵小军', '2023009', 'class_2');
+        INSERT INTO grades (id, student_id, subject, score, exam_date, exam_name, teacher_id)
+        VALUES ('grade_9', 'student_9', '数学', 88, '2023-06-01', '期中考试', 'teacher');
+    """)
+    calls = []
+    failing = {'class_1'}
+
+    def fake_ai(env, prompt):
+        calls.append(prompt)
+        if '三年级一班' in prompt and failing:
+            raise RuntimeError('timeout')
+        return f'summary {len(calls)}'
+
+    monkeypatch.setattr(worker, 'call_ai_service', fake_ai)
+    lines = summary_lines(env, 3)
+
+    classes = lines[:-1]
+    assert lines[-1] == {'done': True, 'class_count': len(classes), 'failed': 1}
+    assert len(calls) == len(classes) > 1
+    assert classes[0]['error'] == 'AI分析失败：timeout'
+    assert all('ai_summary' in line for line in classes[1:])
+
+    # 成功的总结已写入缓存，再次请求时只重试失败的班级
+    calls.clear()
+    failing.clear()
+    again = summary_lines(env, 3)
+    assert len(calls) == 1 and again[-1]['failed'] == 0
@@ -0,0 +1,19 @@
+import json
+
+import worker
+
+
+def test_duplicate_subjects_do_not_overwrite_matrix(call):
+    response = call('GET', '/api/analysis/correlation/matrix/class_1?subjects=数学,语文,数学')
+    assert response['status'] == 200
+    result = json.loads(response['body'])
+
+    assert result['subjects'] == ['数学', '语文']
+    assert result['matrix']['数学']['数学']['pearson'] == 1.0
+    assert set(result['matrix']['数学']) == {'数学', '语文'}
+
+
+def test_calculate_correlation_matrix_ignores_repeated_subjects():
+    rows = [{'数学': 90, '语文': 80}, {'数学': 70, '语文': 75}, {'数学': 60, '语文': 50}]
+    assert worker.calculate_correlation_matrix(rows, ['数学', '语文', '数学']) == \
+        worker.calculate_correlation_matrix(rows, ['数学', '语文'])
@@ -0,0 +1,56 @@
+import base64
+import json
+
+import pytest
+
+
+def post_grade(call, score):
+    grade = {
+        'student_name': '张小明', 'student_id': 'student_1', 'subject': '科学',
+        'score': score, 'exam_date': '2024-01-10', 'exam_name': '月考',
+    }
+    return call('POST', '/api/grades', json.dumps(grade).encode('utf-8'))
+
+
+@pytest.mark.parametrize('score', ['NaN', 'inf', '-Infinity', 150, -1, 'abc', None])
+def test_post_grade_rejects_invalid_score(call, score):
+    response = post_grade(call, score)
+    assert response['status'] == 400
+    assert 'score' in json.loads(response['body'])['error'].lower()
+
+
+def test_post_grade_accepts_score_in_range(call):
+    response = post_grade(call, '99.5')
+    assert response['status'] == 201
+    assert json.loads(response['body'])['grade']['score'] == 99.5
+
+
+@pytest.mark.parametrize('score', ['NaN', 'inf', 101])
+def test_put_grade_rejects_invalid_score(env, call, score):
+    response = call('PUT', '/api/grades/grade_1', json.dumps({'score': score}).encode('utf-8'))
+    assert response['status'] == 400
+    assert env['DB'].conn.execute("SELECT score FROM grades WHERE id = 'grade_1'").fetchone()[0] == 95.0
+
+
+@pytest.mark.parametrize('body', [b'[1]', b'"x"', b'{bad'])
+def test_put_grade_rejects_non_object_body(call, body):
+    assert call('PUT', '/api/grades/grade_1', body)['status'] == 400
+
+
+def encode_cursor(value):
+    return base64.urlsafe_b64encode(json.dumps(value).encode('utf-8')).decode('ascii').rstrip('=')
+
+
+@pytest.mark.parametrize('value', [
+    {'exam_date': '2023-06-01', 'id': 'grade_1'}, ['2023-06-01'], ['2023-06-01', 'grade_1', 'x'],
+    ['2023-06-01', ['grade_1']], [None, 'grade_1'], 5, 'grade_1',
+])
+def test_list_grades_rejects_malformed_cursor(call, value):
+    assert call('GET', '/api/grades?cursor=' + encode_cursor(value))['status'] == 400
+
+
+def test_list_grades_pages_with_cursor(call):
+    first = json.loads(call('GET', '/api/grades?limit=1')['body'])
+    assert first['next_cursor'] == encode_cursor([first['grades'][0]['exam_date'], first['grades'][0]['id']])
+    second = json.loads(call('GET', '/api/grades?limit=1&cursor=' + first['next_cursor'])['body'])
+    assert second['grades'][0]['id'] != first['grades'][0]['id']
@@ -0,0 +1,14 @@
+import pytest
+
+import worker
+
+
+@pytest.mark.parametrize('filters', [{'class_id': 'class_1'}, {'exam_name': '期中考试'}, {'grade_level': 3}])
+def test_iter_grade_pages_walks_scope_in_keyset_order(env, filters):
+    pages = list(worker.iter_grade_pages(env, filters, worker.EXPORT_FIELDS, page_size=2))
+    exported = [grade for page in pages for grade in page]
+
+    everything, _ = worker.list_grades(env, filters, worker.EXPORT_FIELDS + ['id'], limit=worker.GRADE_LIST_MAX_LIMIT)
+    assert len(exported) == len(everything) > 2
+    assert all(len(page) <= 2 for page in pages)
+    assert exported == [{field: grade[field] for field in worker.EXPORT_FIELDS} for grade in everything]
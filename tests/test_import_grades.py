@@ -0,0 +1,84 @@
+import json
+
+import worker
+
+IMPORT_HEADER = '学生姓名,学号,科目,分数,考试日期,考试名称\n'
+
+
+def import_csv(call, rows, query='', **identity):
+    """以multipart上传CSV导入成绩，返回 (状态码, 响应JSON)"""
+    content = IMPORT_HEADER + ''.join(row + '\n' for row in rows)
+    body = (
+        '--B\r\nContent-Disposition: form-data; name="file"; filename="grades.csv"\r\n'
+        'Content-Type: text/csv\r\n\r\n' + content + '\r\n--B--\r\n'
+    ).encode('utf-8')
+    response = call('POST', '/api/import/grades' + query, body,
+                    {'Content-Type': 'multipart/form-data; boundary=B'}, **identity)
+    return response['status'], json.loads(response['body'])
+
+
+def stored_scores(env, exam_name):
+    rows = env['DB'].conn.execute(
+        "SELECT student_id, subject, score FROM grades WHERE exam_name = ? ORDER BY student_id, subject", (exam_name,)
+    )
+    return [tuple(row) for row in rows]
+
+
+def test_non_finite_score_is_reported_on_its_line(env, call):
+    status, result = import_csv(call, [
+        '张小明,student_1,数学,nan,2024-01-10,月考',
+        '张小明,student_1,语文,inf,2024-01-10,月考',
+        '李小红,student_2,数学,101,2024-01-10,月考',
+        '李小红,student_2,语文,80,2024-01-10,月考',
+    ])
+
+    assert status == 200
+    assert result['inserted'] == 1
+    assert result['errors'] == [
+        'Line 2: Score must be between 0 and 100',
+        'Line 3: Score must be between 0 and 100',
+        'Line 4: Score must be between 0 and 100',
+    ]
+    assert stored_scores(env, '月考') == [('student_2', '语文', 80.0)]
+
+
+def test_admin_upload_rejects_only_new_students_without_class(env, call):
+    status, result = import_csv(call, [
+        '新同学,student_new,数学,90,2024-01-10,月考',
+        '张小明,student_1,数学,70,2024-01-10,月考',
+    ], role='admin', class_id=None, user_id='admin')
+
+    assert status == 200
+    assert result['inserted'] == 1
+    assert result['errors'] == ['Line 2: Student does not exist and no class is available to create it']
+    assert stored_scores(env, '月考') == [('student_1', '数学', 70.0)]
+    assert env['DB'].conn.execute("SELECT COUNT(*) FROM students WHERE id = 'student_new'").fetchone()[0] == 0
+
+
+def test_errors_are_capped_with_total_count(call, monkeypatch):
+    monkeypatch.setattr(worker, 'IMPORT_ERROR_LIMIT', 3)
+    status, result = import_csv(call, ['多余,列'] + [f'张小明,student_1,科目{i},abc,2024-01-10,月考' for i in range(5)])
+
+    assert status == 200
+    assert result['errors'] == ['Line 2: Column count mismatch', 'Line 3: Invalid score', 'Line 4: Invalid score']
+    assert result['error_count'] == 6
+    assert result['errors_truncated'] is True
+
+
+def test_duplicates_across_chunks_follow_write_mode(env, call, monkeypatch):
+    monkeypatch.setattr(worker, 'IMPORT_CHUNK_ROWS', 2)
+    rows = [
+        '张小明,student_1,数学,60,2024-01-10,月考',
+        '张小明,student_1,数学,61,2024-01-10,月考',  # 同一批次内重复
+        '张小明,student_1,语文,70,2024-01-10,月考',
+        '张小明,student_1,数学,65,2024-01-10,月考',  # 与第一批次重复
+    ]
+
+    status, result = import_csv(call, rows, '?mode=insert')
+    assert status == 200
+    assert result['errors'] == ['Line 3: Duplicate of line 2', 'Line 5: Grade already exists']
+    assert stored_scores(env, '月考') == [('student_1', '数学', 60.0), ('student_1', '语文', 70.0)]
+
+    status, result = import_csv(call, rows)
+    assert status == 200
+    assert stored_scores(env, '月考') == [('student_1', '数学', 65.0), ('student_1', '语文', 70.0)]
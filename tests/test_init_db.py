@@ -0,0 +1,52 @@
+import json
+import sqlite3
+
+import pytest
+
+import init_db
+
+
+@pytest.fixture(scope='module')
+def conn():
+    conn = sqlite3.connect(':memory:')
+    init_db.apply_migrations(conn)
+    init_db.insert_test_data(conn.cursor())
+    yield conn
+    conn.close()
+
+
+@pytest.mark.parametrize('check', init_db.QUERY_PLAN_CHECKS, ids=[check[0] for check in init_db.QUERY_PLAN_CHECKS])
+def test_query_plan_uses_expected_index(conn, check):
+    name, sql, params, index_name = check
+    plan = init_db.explain_query_plan(conn, sql, params)
+    assert init_db.query_plan_uses_index(plan, index_name), f"{name}: {plan}"
+
+
+def test_apply_migrations_is_idempotent(conn):
+    assert init_db.apply_migrations(conn) == []
+    assert init_db.get_applied_versions(conn) == {version for version, _, _ in init_db.MIGRATIONS}
+
+
+def test_render_migrations_sql_skips_applied_versions():
+    output = json.dumps([{'results': [{'version': 1}, {'version': 2}], 'success': True, 'meta': {}}])
+    applied = init_db.parse_applied_versions(output)
+    sql = init_db.render_migrations_sql(applied)
+
+    assert applied == {1, 2}
+    assert '-- 迁移 1:' not in sql and '-- 迁移 2:' not in sql
+    for version, name, _ in init_db.MIGRATIONS[2:]:
+        assert f'-- 迁移 {version}: {name}' in sql
+
+
+def test_render_migrations_sql_applies_to_new_database():
+    conn = sqlite3.connect(':memory:')
+    conn.executescript(init_db.render_migrations_sql())
+    assert init_db.get_applied_versions(conn) == {version for version, _, _ in init_db.MIGRATIONS}
+    conn.close()
+
+
+@pytest.mark.parametrize('check', init_db.GRADE_LIST_PLAN_CHECKS, ids=[check[0] for check in init_db.GRADE_LIST_PLAN_CHECKS])
+def test_grade_list_plan_reads_in_index_order(conn, check):
+    name, sql, params, _ = check
+    plan = init_db.explain_query_plan(conn, sql, params)
+    assert not init_db.query_plan_uses_temp_sort(plan), f"{name}: {plan}"
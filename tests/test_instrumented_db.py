@@ -0,0 +1,28 @@
+import sqlite3
+
+import pytest
+
+import worker
+
+
+def test_failed_batch_is_recorded(env):
+    db = worker.InstrumentedDB(env['DB'])
+    good = db.prepare("SELECT id FROM grades")
+    bad = db.prepare("INSERT INTO grades (id) VALUES (?)").bind('grade_x')
+
+    with pytest.raises(sqlite3.IntegrityError):
+        db.batch([good, bad])
+
+    assert (db.stats.queries, db.stats.round_trips, db.stats.rows) == (2, 1, 0)
+    assert db.stats.duration > 0
+
+
+def test_failed_statement_is_recorded(env):
+    db = worker.InstrumentedDB(env['DB'])
+    db.prepare("SELECT id FROM grades").all()
+    rows = db.stats.rows
+
+    with pytest.raises(sqlite3.OperationalError):
+        db.prepare("SELECT missing FROM grades").first()
+
+    assert (db.stats.queries, db.stats.round_trips, db.stats.rows) == (2, 2, rows)
@@ -0,0 +1,39 @@
+import pytest
+
+import worker
+
+
+@pytest.mark.parametrize('if_none_match, matches', [
+    (None, False),
+    ('*', True),
+    ('"{etag}"', True),
+    ('W/"{etag}"', True),
+    ('"other", "{etag}"', True),
+    ('"{etag}-gzip"', False),
+    ('"{etag}-br"', False),
+    ('"other"', False),
+])
+def test_etag_matches_compares_whole_tag(if_none_match, matches):
+    etag = '"0123456789abcdef"'
+    header = if_none_match and if_none_match.format(etag=etag.strip('"'))
+    assert worker.etag_matches(header, etag) is matches
+
+
+def test_static_file_revalidates_with_etag(call):
+    first = call('GET', '/styles.css')
+    assert first['status'] == 200
+    again = call('GET', '/styles.css', headers={'If-None-Match': first['headers']['ETag']})
+    assert again['status'] == 304 and again['body'] == b''
+
+
+def test_static_file_is_immutable_only_for_current_version(call):
+    version = worker.load_static_asset('dist/app.js', 'application/javascript')['version']
+    assert f'app.js?v={version}'.encode() in call('GET', '/')['body']
+
+    def cache_control(path):
+        return call('GET', path)['headers']['Cache-Control']
+
+    assert cache_control(f'/app.js?v={version}') == worker.STATIC_CACHE_CONTROL
+    assert cache_control('/app.js') == worker.STATIC_REVALIDATE_CACHE_CONTROL
+    assert cache_control('/app.js?v=000000000000') == worker.STATIC_REVALIDATE_CACHE_CONTROL
+    assert cache_control(f'/index.html?v={version}') == worker.STATIC_REVALIDATE_CACHE_CONTROL
@@ -0,0 +1,42 @@
+import worker
+
+
+def round_trips(env, func, *args, **kwargs):
+    """执行 func，返回 (结果, 与数据库的往返次数)"""
+    db = env['DB']
+    db.round_trips = 0
+    result = func(env, *args, **kwargs)
+    return result, db.round_trips
+
+
+def test_update_grade_in_one_round_trip(env):
+    updated, trips = round_trips(env, worker.update_grade, 'grade_1', score=60.0)
+    assert trips == 1
+    assert updated['id'] == 'grade_1' and updated['score'] == 60.0
+    stats = worker.get_grade_stats(env, 'class_1', '期中考试')
+    assert {row['subject']: row['score_max'] for row in stats}['数学'] == 87.0
+
+
+def test_update_missing_grade_in_one_round_trip(env):
+    updated, trips = round_trips(env, worker.update_grade, 'grade_missing', score=60.0)
+    assert trips == 1
+    assert updated is None
+
+
+def test_update_grade_without_changes_in_one_round_trip(env):
+    current, trips = round_trips(env, worker.update_grade, 'grade_1')
+    assert trips == 1
+    assert current['score'] == 95.0
+
+
+def test_delete_grade_in_one_round_trip(env):
+    deleted, trips = round_trips(env, worker.delete_grade, 'grade_1')
+    assert trips == 1
+    assert deleted['id'] == 'grade_1'
+    assert worker.get_grade(env, 'grade_1') is None
+
+
+def test_delete_missing_grade_in_one_round_trip(env):
+    deleted, trips = round_trips(env, worker.delete_grade, 'grade_missing')
+    assert trips == 1
+    assert deleted is None